@@ -1,14 +1,42 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
+import json
 import re
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, Response
 from git import Repo
-from typing import List
+from sqlalchemy import func
+from typing import List, Optional
 import os
 
-from models import SessionLocal, Commit, File, Snapshot
-from .models import CommitOut, SnapshotOut, DiffOut
+import metrics
+from diff_cache import cached_diff
+from models import SessionLocal, Commit, File, FileLayout, FileRemoval, IngestPhase, Snapshot, SnapshotPeriod
+from .middleware import MetricsMiddleware, SlowRequestProfilerMiddleware
+from search import search
+from shared_cache import SharedCache
+from .models import CommitOut, SnapshotOut, DiffOut, FilePositionOut, LayoutOut, SearchOut
 
-app = FastAPI(title="TimeWarp Git API")
+# Set by server.py so every worker process reads and fills the same cache
+shared_cache = SharedCache.from_env()
+
+
+def _metrics_dir() -> Optional[str]:
+    # Every worker exports here, so whichever one answers a scrape reports them all
+    return shared_cache.subdirectory("metrics") if shared_cache is not None else None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs in each serving worker, not in server.py's parent process
+    if shared_cache is not None:
+        metrics.start_exporter(_metrics_dir())
+    yield
+    if shared_cache is not None:
+        metrics.export(_metrics_dir())
+
+
+app = FastAPI(title="TimeWarp Git API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,12 +45,33 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+
+# Opt-in request profiling: TIMEWARP_PROFILE_SLOW_MS=250 keeps profiles of requests slower than 250 ms
+if os.getenv("TIMEWARP_PROFILE_SLOW_MS"):
+    app.add_middleware(
+        SlowRequestProfilerMiddleware,
+        threshold_ms=float(os.environ["TIMEWARP_PROFILE_SLOW_MS"]),
+        output_dir=os.getenv("TIMEWARP_PROFILE_DIR", "profiles"),
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Expose metrics summed over all workers, plus the ingest phase totals stored in the database."""
+    session = SessionLocal(read_only=True)
+    try:
+        phases = {row.phase: (row.calls, row.seconds, row.cpu_seconds) for row in session.query(IngestPhase)}
+    finally:
+        session.close()
+    body = metrics.render(phases, workers_dir=_metrics_dir())
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
 
 
 @app.get("/timeline", response_model=List[CommitOut])
 async def get_timeline(page: int = 1, page_size: int = 200):
     """Get timeline of commits ordered by timestamp."""
-    session = SessionLocal()
+    session = SessionLocal(read_only=True)
     try:
         page = max(1, page)
         page_size = min(max(1, page_size), 1000)
@@ -43,37 +92,141 @@ async def get_timeline(page: int = 1, page_size: int = 200):
         session.close()
 
 
-@app.get("/snapshot/{commit_id}", response_model=List[SnapshotOut])
-async def get_snapshot(commit_id: str):
-    """Get file snapshots for a specific commit."""
-    session = SessionLocal()
-    try:
+def _snapshot_payload(session, commit_id: str) -> Optional[bytes]:
+    """JSON body for /snapshot, or None if the commit has no snapshots."""
+    key = None
+    if shared_cache is not None:
+        # Ingest and compaction both add snapshot rows, so the max id changes and old entries go stale
+        generation = session.query(func.max(Snapshot.id)).scalar()
+        key = f"{session.get_bind().url}:{generation}:{commit_id}"
+        payload = shared_cache.get("snapshot", key)
+        if payload is not None:
+            return payload
+
+    snapshots = (
+        session.query(Snapshot, File)
+        .join(File, Snapshot.file_id == File.id)
+        .filter(Snapshot.commit_id == commit_id)
+        .all()
+    )
+    if not snapshots:
+        # Downsampled by compact.py: serve the commit standing for its period
+        period = session.get(SnapshotPeriod, commit_id)
+        if period is None:
+            return None
         snapshots = (
             session.query(Snapshot, File)
             .join(File, Snapshot.file_id == File.id)
-            .filter(Snapshot.commit_id == commit_id)
+            .filter(Snapshot.commit_id == period.representative_id)
             .all()
         )
-
         if not snapshots:
-            raise HTTPException(status_code=404, detail="Commit not found")
+            return None
 
-        return [
+    payload = json.dumps(
+        [
             SnapshotOut(
+                file_id=file.id,
                 path=file.path,
                 churn=snapshot.churn,
                 hotspot_score=snapshot.hotspot_score,
-            )
+            ).model_dump()
             for snapshot, file in snapshots
         ]
+    ).encode("utf-8")
+    if key is not None:
+        shared_cache.set("snapshot", key, payload)
+    return payload
+
+
+def warm_snapshot_cache(limit: int) -> int:
+    """Fill the shared cache with the ``limit`` most recent commits' snapshots."""
+    if shared_cache is None or limit <= 0:
+        return 0
+    session = SessionLocal(read_only=True)
+    try:
+        commit_ids = [
+            row[0] for row in session.query(Commit.id).order_by(Commit.timestamp.desc()).limit(limit)
+        ]
+        return sum(1 for commit_id in commit_ids if _snapshot_payload(session, commit_id) is not None)
+    finally:
+        session.close()
+
+
+@app.get("/snapshot/{commit_id}", response_model=List[SnapshotOut])
+async def get_snapshot(commit_id: str):
+    """Get file snapshots for a specific commit."""
+    session = SessionLocal(read_only=True)
+    try:
+        payload = _snapshot_payload(session, commit_id)
+        if payload is None:
+            raise HTTPException(status_code=404, detail="Commit not found")
+        return Response(content=payload, media_type="application/json")
+    finally:
+        session.close()
+
+
+@app.get("/layout", response_model=LayoutOut)
+async def get_layout(since_id: int = 0):
+    """Get stable 3D positions keyed by file id, optionally only ids > since_id.
+
+    ``removed`` lists ids at or below ``since_id`` whose files were deleted.
+    """
+    session = SessionLocal(read_only=True)
+    try:
+        rows = (
+            session.query(FileLayout, File.path)
+            .join(File, FileLayout.file_id == File.id)
+            .filter(FileLayout.file_id > since_id)
+            .order_by(FileLayout.file_id)
+            .all()
+        )
+        # Only ids the caller can have cached
+        removed = [
+            row[0]
+            for row in session.query(FileRemoval.file_id)
+            .filter(FileRemoval.file_id <= since_id)
+            .order_by(FileRemoval.file_id)
+        ]
+        return LayoutOut(
+            version=rows[-1][0].file_id if rows else max(since_id, 0),
+            files={
+                layout.file_id: FilePositionOut(path=path, x=layout.x, y=layout.y, z=layout.z)
+                for layout, path in rows
+            },
+            removed=removed,
+        )
+    finally:
+        session.close()
+
+
+@app.get("/search", response_model=SearchOut)
+async def get_search(q: str, limit: int = 20, page_size: int = 200):
+    """Search commit messages/authors and file paths, with timeline positions."""
+    session = SessionLocal(read_only=True)
+    try:
+        limit = min(max(1, limit), 100)
+        page_size = min(max(1, page_size), 1000)
+        return search(session, q, limit=limit, page_size=page_size)
     finally:
         session.close()
 
 
+def _read_blob(commit, path: str) -> str:
+    blob = commit.tree[path]
+    data = shared_cache.get("blob", blob.hexsha) if shared_cache is not None else None
+    if data is None:
+        data = blob.data_stream.read()
+        metrics.record_git_read("diff", data)
+        if shared_cache is not None:
+            shared_cache.set("blob", blob.hexsha, data)
+    return data.decode("utf-8", errors="ignore")
+
+
 @app.get("/diff/{commit_id}/{path:path}", response_model=DiffOut)
 async def get_diff(commit_id: str, path: str):
     """Get diff for a specific file at a commit."""
-    session = SessionLocal()
+    session = SessionLocal(read_only=True)
     try:
         # Basic input validation
         if not re.fullmatch(r"[0-9a-fA-F]{6,64}", commit_id):
@@ -81,6 +234,12 @@ async def get_diff(commit_id: str, path: str):
         if ".." in path or path.startswith("/") or path.startswith("\\"):
             raise HTTPException(status_code=400, detail="Invalid path")
 
+        # Precomputed at ingest for hot files; avoids opening the repository
+        cached = cached_diff(session, commit_id, path)
+        metrics.record_cache("diff", cached is not None)
+        if cached is not None:
+            return DiffOut(before=cached[0], after=cached[1])
+
         # Get the commit
         commit = session.query(Commit).filter(Commit.id == commit_id).first()
         if not commit:
@@ -106,31 +265,18 @@ async def get_diff(commit_id: str, path: str):
 
         if len(current_commit.parents) == 0:
             # Root commit - no parent to diff against
-            return DiffOut(
-                before="",
-                after=current_commit.tree[path]
-                .data_stream.read()
-                .decode("utf-8", errors="ignore"),
-            )
+            return DiffOut(before="", after=_read_blob(current_commit, path))
 
         parent_commit = current_commit.parents[0]
 
         # Get file content from current and parent commits
         try:
-            current_content = (
-                current_commit.tree[path]
-                .data_stream.read()
-                .decode("utf-8", errors="ignore")
-            )
+            current_content = _read_blob(current_commit, path)
         except Exception:
             current_content = ""
 
         try:
-            parent_content = (
-                parent_commit.tree[path]
-                .data_stream.read()
-                .decode("utf-8", errors="ignore")
-            )
+            parent_content = _read_blob(parent_commit, path)
         except Exception:
             parent_content = ""
 
@@ -0,0 +1,94 @@
+import cProfile
+import os
+import re
+import time
+
+import metrics
+from profiling import write_stats
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and SQL usage."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        token = metrics.begin_request()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            queries, db_seconds = metrics.end_request(token)
+            # Label by route template, not raw path, to keep cardinality bounded
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            metrics.http_request_duration.observe(elapsed, method=method, route=route)
+            metrics.http_requests.inc(method=method, route=route, status=str(status["code"]))
+            metrics.http_request_db_queries.observe(queries, route=route)
+            metrics.http_request_db_seconds.observe(db_seconds, route=route)
+
+
+class SlowRequestProfilerMiddleware:
+    """Opt-in ASGI middleware that profiles requests and keeps the slow ones.
+
+    cProfile follows the event-loop thread, not one task, so anything else
+    that runs on the loop while a request is suspended lands in its profile.
+    A request is therefore only profiled when no other request is in flight,
+    and its profile is discarded if another request arrived before it
+    finished. Profiles of requests slower than ``threshold_ms`` are written to
+    ``output_dir``; every slow request is counted in
+    ``timewarp_slow_requests_total``, including those that could not be
+    profiled.
+    """
+
+    def __init__(self, app, threshold_ms: float, output_dir: str):
+        self.app = app
+        self.threshold = threshold_ms / 1000.0
+        self.output_dir = output_dir
+        # Only touched from the event-loop thread
+        self._in_flight = 0
+        self._arrivals = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        self._arrivals += 1
+        self._in_flight += 1
+        arrival = self._arrivals
+        profiler = None
+        if self._in_flight == 1:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            self._in_flight -= 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.threshold:
+                route = getattr(scope.get("route"), "path", "unmatched")
+                # Nothing else started meanwhile, so the profile is this request's alone
+                profiled = profiler is not None and self._arrivals == arrival
+                metrics.slow_requests.inc(route=route, profiled="true" if profiled else "false")
+                if profiled:
+                    os.makedirs(self.output_dir, exist_ok=True)
+                    slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+                    name = f"{int(time.time() * 1000)}-{scope['method']}-{slug}-{int(elapsed * 1000)}ms"
+                    write_stats(profiler, os.path.join(self.output_dir, name))
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import Dict, List, Optional
 
 
 class CommitOut(BaseModel):
@@ -9,6 +9,7 @@ class CommitOut(BaseModel):
 
 
 class SnapshotOut(BaseModel):
+    file_id: int
     path: str
     churn: int
     hotspot_score: float
@@ -17,3 +18,43 @@ class SnapshotOut(BaseModel):
 class DiffOut(BaseModel):
     before: str
     after: str
+
+
+class FilePositionOut(BaseModel):
+    path: str
+    x: float
+    y: float
+    z: float
+
+
+class LayoutOut(BaseModel):
+    # Highest file id included; pass back as since_id to fetch only new files
+    version: int
+    files: Dict[int, FilePositionOut]
+    # Ids up to since_id whose files were deleted by compaction; drop them from caches
+    removed: List[int] = []
+
+
+class CommitHitOut(BaseModel):
+    id: str
+    timestamp: float
+    author: str
+    message: str
+    # Index in /timeline order and the /timeline page holding it
+    position: int
+    page: int
+
+
+class FileHitOut(BaseModel):
+    file_id: int
+    path: str
+    # Most recent commit touching the file, if it has any snapshots
+    commit_id: Optional[str]
+    timestamp: Optional[float]
+    position: Optional[int]
+    page: Optional[int]
+
+
+class SearchOut(BaseModel):
+    commits: List[CommitHitOut]
+    files: List[FileHitOut]
@@ -3,22 +3,32 @@
 import argparse
 import random
 from git import Repo
+from git_walk import CommitWalker, add_walk_arguments, walk_options
+from layout import assign_layout, ensure_layouts
+from metrics import phase
 from models import SessionLocal, Commit, File, Snapshot
+from profiling import profile_run, record_phases
 
 
-def ingest_repository(repo_path: str, db_url: str):
-    """Ingest a Git repository into the database."""
+def ingest_repository(repo_path: str, db_url: str, **walk_options):
+    """Ingest a Git repository into the database.
+
+    ``walk_options`` are passed to ``CommitWalker`` (path globs, date window,
+    first-parent/merge handling).
+    """
     session = SessionLocal(db_url)
 
     try:
         repo = Repo(repo_path)
-        commits = list(repo.iter_commits("HEAD"))
-        commits.reverse()  # oldest to newest
+        walker = CommitWalker(repo, **walk_options)
+        # Files ingested before layouts existed get positions first, so
+        # directory order still reflects first appearance
+        ensure_layouts(session)
 
         total_commits = 0
         total_snapshots = 0
 
-        for commit in commits:
+        for commit in walker.commits():
             # Insert commit if not exists
             existing_commit = (
                 session.query(Commit).filter(Commit.id == commit.hexsha).first()
@@ -31,37 +41,43 @@ def ingest_repository(repo_path: str, db_url: str):
                     message=commit.message,
                 )
                 session.add(db_commit)
-                session.commit()
+                with phase("db_writes"):
+                    session.commit()
                 total_commits += 1
 
             # Traverse commit tree blobs and ensure File rows exist
-            for blob in commit.tree.traverse():
-                if blob.type == "blob":  # Only process files, not directories
-                    existing_file = (
-                        session.query(File).filter(File.path == blob.path).first()
-                    )
-                    if not existing_file:
-                        db_file = File(path=blob.path)
-                        session.add(db_file)
+            with phase("git_extraction"):
+                blobs = list(walker.blobs(commit))
+            for blob in blobs:
+                existing_file = (
+                    session.query(File).filter(File.path == blob.path).first()
+                )
+                if not existing_file:
+                    db_file = File(path=blob.path)
+                    session.add(db_file)
+                    session.flush()
+                    assign_layout(session, db_file)
+                    with phase("db_writes"):
                         session.commit()
 
-                    # Get the file ID (either existing or newly created)
-                    file = session.query(File).filter(File.path == blob.path).first()
+                # Get the file ID (either existing or newly created)
+                file = session.query(File).filter(File.path == blob.path).first()
 
-                    # Generate placeholder churn data
-                    churn = random.randint(0, 20)
+                # Generate placeholder churn data
+                churn = random.randint(0, 20)
 
-                    # Insert snapshot
-                    snapshot = Snapshot(
-                        commit_id=commit.hexsha,
-                        file_id=file.id,
-                        churn=churn,
-                        hotspot_score=0.0,  # Will be calculated by ML model later
-                    )
-                    session.add(snapshot)
-                    total_snapshots += 1
+                # Insert snapshot
+                snapshot = Snapshot(
+                    commit_id=commit.hexsha,
+                    file_id=file.id,
+                    churn=churn,
+                    hotspot_score=0.0,  # Will be calculated by ML model later
+                )
+                session.add(snapshot)
+                total_snapshots += 1
 
-            session.commit()
+            with phase("db_writes"):
+                session.commit()
 
         print(f"{total_commits} commits, {total_snapshots} snapshots")
 
@@ -81,10 +97,18 @@ def main():
     parser.add_argument(
         "--db-url", default="sqlite:///timewarp.db", help="Database URL"
     )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="Write a cProfile report, per-phase timings and peak memory to DIR",
+    )
+
+    add_walk_arguments(parser)
 
     args = parser.parse_args()
 
-    ingest_repository(args.repo, args.db_url)
+    with record_phases(args.db_url), profile_run(args.profile, "ingest"):
+        ingest_repository(args.repo, args.db_url, **walk_options(args))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,303 @@
+"""Retention and compaction for a TimeWarp database.
+
+Snapshots of commits older than a cutoff are downsampled into one set per
+period (day, week or 30 days). The period's latest commit keeps one row per
+file with the summed churn, max score and max label. Every other commit in
+the period is recorded in ``snapshot_periods`` so ``/snapshot`` can serve the
+representative instead; the aggregated rows carry no training features. After
+that, features of unlabeled rows (and, if asked, of commits older than a
+retention window), orphaned rows and unreferenced diff cache entries are
+removed; deleted file ids are recorded in ``file_removals`` and never reused. Free pages are returned with incremental VACUUM in small steps, so the
+write lock is never held for long.
+"""
+
+import argparse
+import os
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import Integer, cast, func, insert, literal, null, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from metrics import phase
+from models import (
+    Commit,
+    DiffBlob,
+    DiffRef,
+    File,
+    FileLayout,
+    FileRemoval,
+    SessionLocal,
+    Snapshot,
+    SnapshotPeriod,
+    _sqlite_file_path,
+    get_engine,
+)
+from profiling import record_phases
+
+PERIODS = {"day": 86400, "week": 7 * 86400, "month": 30 * 86400}
+DAY = 86400
+
+
+def downsample(session: Session, cutoff: float, period_seconds: int) -> Dict[str, int]:
+    """Collapse snapshots of whole periods ending before ``cutoff``; one commit per period."""
+    # Only periods entirely before the cutoff, so reruns never split one
+    end = int(cutoff // period_seconds) * period_seconds
+    bucket = cast(Commit.timestamp / period_seconds, Integer)
+    buckets = [
+        row[0]
+        for row in session.query(bucket)
+        .join(Snapshot, Snapshot.commit_id == Commit.id)
+        .filter(Commit.timestamp < end)
+        .group_by(bucket)
+        .having(func.count(func.distinct(Snapshot.commit_id)) > 1)
+        .order_by(bucket)
+    ]
+
+    stats = {"periods": 0, "commits": 0, "snapshots_removed": 0, "features_dropped": 0}
+    for b in buckets:
+        start = float(b * period_seconds)
+        in_period = select(Commit.id).where(Commit.timestamp >= start, Commit.timestamp < start + period_seconds)
+        # The latest commit with snapshots shows the state at the end of the period
+        representative = (
+            session.query(Commit.id)
+            .filter(Commit.id.in_(select(Snapshot.commit_id).where(Snapshot.commit_id.in_(in_period))))
+            .order_by(Commit.timestamp.desc(), Commit.id.desc())
+            .limit(1)
+            .scalar()
+        )
+        last_id = session.query(func.max(Snapshot.id)).scalar()
+        with_rows = select(Snapshot.commit_id).where(Snapshot.commit_id.in_(in_period)).distinct()
+
+        # Commits compacted on an earlier run follow the period's new representative
+        session.query(SnapshotPeriod).filter(SnapshotPeriod.commit_id.in_(with_rows)).delete(
+            synchronize_session=False
+        )
+        session.query(SnapshotPeriod).filter(SnapshotPeriod.commit_id.in_(in_period)).update(
+            {SnapshotPeriod.representative_id: representative}, synchronize_session=False
+        )
+        mapped = session.execute(
+            insert(SnapshotPeriod).from_select(
+                ["commit_id", "representative_id", "period_start"],
+                select(Commit.id, literal(representative), literal(start)).where(
+                    Commit.id.in_(with_rows), Commit.id != representative
+                ),
+            )
+        ).rowcount
+
+        before = session.query(Snapshot).filter(Snapshot.commit_id.in_(in_period)).count()
+        with_features = (
+            session.query(Snapshot)
+            .filter(Snapshot.commit_id.in_(in_period), Snapshot.tmp_features.isnot(None))
+            .count()
+        )
+        # A period's summed churn is no one commit's feature vector, so the
+        # aggregates get none and the originals' features go with them
+        session.execute(
+            insert(Snapshot).from_select(
+                ["commit_id", "file_id", "churn", "hotspot_score", "label"],
+                select(
+                    literal(representative),
+                    Snapshot.file_id,
+                    func.sum(Snapshot.churn),
+                    func.max(Snapshot.hotspot_score),
+                    func.max(Snapshot.label),
+                )
+                .where(Snapshot.commit_id.in_(in_period))
+                .group_by(Snapshot.file_id),
+            )
+        )
+        session.query(Snapshot).filter(Snapshot.commit_id.in_(in_period), Snapshot.id <= last_id).delete(
+            synchronize_session=False
+        )
+        after = session.query(Snapshot).filter(Snapshot.commit_id.in_(in_period)).count()
+        # One short write transaction per period
+        session.commit()
+
+        stats["periods"] += 1
+        stats["commits"] += mapped
+        stats["snapshots_removed"] += before - after
+        stats["features_dropped"] += with_features
+    return stats
+
+
+def drop_features(session: Session, keep_after: Optional[float], batch_size: int = 50000) -> int:
+    """Clear cached feature vectors outside the training window.
+
+    Features of commits before ``keep_after`` are dropped, as are those of
+    unlabeled rows, which training never reads. ``keep_after=None`` keeps
+    every labeled row's features.
+    """
+    dropped = 0
+    max_id = session.query(func.max(Snapshot.id)).scalar() or 0
+    old_commits = select(Commit.id).where(Commit.timestamp < keep_after) if keep_after is not None else None
+    for low in range(0, max_id + 1, batch_size):
+        query = session.query(Snapshot).filter(
+            Snapshot.id > low, Snapshot.id <= low + batch_size, Snapshot.tmp_features.isnot(None)
+        )
+        if old_commits is not None:
+            query = query.filter(Snapshot.label.is_(None) | Snapshot.commit_id.in_(old_commits))
+        else:
+            query = query.filter(Snapshot.label.is_(None))
+        # SQL NULL, not JSON null, so the training query's IS NOT NULL skips them
+        dropped += query.update({Snapshot.tmp_features: null()}, synchronize_session=False)
+        session.commit()
+    return dropped
+
+
+def prune_orphans(session: Session) -> Dict[str, int]:
+    """Delete rows nothing points at any more, children before parents."""
+    commit_ids = select(Commit.id)
+    live_files = select(Snapshot.file_id).distinct()
+    stats = {
+        "snapshots": session.query(Snapshot).filter(Snapshot.commit_id.not_in(commit_ids)).delete(
+            synchronize_session=False
+        ),
+        "snapshot_periods": session.query(SnapshotPeriod)
+        .filter(
+            SnapshotPeriod.commit_id.not_in(commit_ids)
+            | ~select(Snapshot.id).where(Snapshot.commit_id == SnapshotPeriod.representative_id).exists()
+        )
+        .delete(synchronize_session=False),
+        "diff_refs": session.query(DiffRef)
+        .filter(DiffRef.commit_id.not_in(commit_ids) | DiffRef.file_id.not_in(live_files))
+        .delete(synchronize_session=False),
+    }
+    # Tombstones tell /layout clients to drop cached positions; ids are never
+    # reused (files is AUTOINCREMENT), so a returning path gets a fresh id
+    session.execute(
+        insert(FileRemoval).from_select(["file_id"], select(File.id).where(File.id.not_in(live_files)))
+    )
+    stats["file_layouts"] = session.query(FileLayout).filter(FileLayout.file_id.not_in(live_files)).delete(
+        synchronize_session=False
+    )
+    stats["files"] = session.query(File).filter(File.id.not_in(live_files)).delete(synchronize_session=False)
+    stats["diff_blobs"] = (
+        session.query(DiffBlob)
+        .filter(
+            ~select(DiffRef.commit_id)
+            .where(DiffRef.blob_before == DiffBlob.blob_before, DiffRef.blob_after == DiffBlob.blob_after)
+            .exists()
+        )
+        .delete(synchronize_session=False)
+    )
+    session.commit()
+    return stats
+
+
+def _database_bytes(engine: Engine) -> int:
+    path = _sqlite_file_path(str(engine.url))
+    if path is None:
+        return 0
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+def vacuum(engine: Engine, pages_per_step: int = 1000, full: bool = False) -> None:
+    """Return free pages to the filesystem, then refresh planner statistics.
+
+    Incremental VACUUM only works once ``auto_vacuum=INCREMENTAL`` is in
+    effect, which new databases get automatically. ``full=True`` runs one
+    plain VACUUM instead, which converts older files but holds an exclusive
+    lock while it rewrites the whole database.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    if full:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("VACUUM")
+            # VACUUM may renumber implicit rowids, which commits_fts is keyed by
+            has_fts = conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'commits_fts'"
+            ).first()
+            if has_fts:
+                conn.exec_driver_sql("INSERT INTO commits_fts(commits_fts) VALUES ('rebuild')")
+    else:
+        raw = engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                free = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+                while free:
+                    # A plain execute frees a single page; executescript steps the pragma to completion
+                    raw.driver_connection.executescript(
+                        f"BEGIN; PRAGMA incremental_vacuum({pages_per_step}); COMMIT;"
+                    )
+                    remaining = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+                    if remaining >= free:
+                        break
+                    free = remaining
+        finally:
+            raw.close()
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # Bounded sampling keeps ANALYZE quick on large tables
+        conn.exec_driver_sql("PRAGMA analysis_limit=1000")
+        conn.exec_driver_sql("ANALYZE")
+        conn.exec_driver_sql("PRAGMA optimize")
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+
+def compact(
+    db_url: Optional[str] = None,
+    older_than_days: float = 365,
+    period: str = "week",
+    keep_features_days: Optional[float] = None,
+    full_vacuum: bool = False,
+    now: Optional[float] = None,
+) -> dict:
+    """Run every compaction step and return what each one removed.
+
+    Labeled rows keep their training features unless ``keep_features_days``
+    is given, since ``ml/train_hotspot.py`` trains on exactly those rows.
+    """
+    now = time.time() if now is None else now
+    engine = get_engine(db_url)
+    size_before = _database_bytes(engine)
+    session = SessionLocal(db_url)
+    try:
+        with phase("compact_downsample"):
+            report = {"downsample": downsample(session, now - older_than_days * DAY, PERIODS[period])}
+        with phase("compact_features"):
+            keep_after = now - keep_features_days * DAY if keep_features_days is not None else None
+            report["features_dropped"] = report["downsample"]["features_dropped"] + drop_features(session, keep_after)
+        with phase("compact_orphans"):
+            report["orphans"] = prune_orphans(session)
+    finally:
+        session.close()
+    with phase("compact_vacuum"):
+        vacuum(engine, full=full_vacuum)
+    report["bytes_before"] = size_before
+    report["bytes_after"] = _database_bytes(engine)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Downsample old snapshots and reclaim database space")
+    parser.add_argument("--db-url", default="sqlite:///timewarp.db", help="Database URL")
+    parser.add_argument("--older-than", type=float, default=365, metavar="DAYS", help="Downsample commits older than this")
+    parser.add_argument("--period", choices=sorted(PERIODS), default="week", help="Aggregation period for old snapshots")
+    parser.add_argument(
+        "--keep-features",
+        type=float,
+        metavar="DAYS",
+        help="Also drop training features of labeled commits older than this (default: keep them)",
+    )
+    parser.add_argument("--full-vacuum", action="store_true", help="Rewrite the whole file (needed once for databases created before incremental vacuum)")
+    args = parser.parse_args()
+
+    with record_phases(args.db_url):
+        report = compact(args.db_url, args.older_than, args.period, args.keep_features, args.full_vacuum)
+    d = report["downsample"]
+    print(f"Downsampled {d['commits']} commits into {d['periods']} periods ({d['snapshots_removed']} snapshots removed)")
+    print(f"Dropped features from {report['features_dropped']} snapshots")
+    print("Removed orphans: " + ", ".join(f"{n} {name}" for name, n in report["orphans"].items()))
+    reclaimed = report["bytes_before"] - report["bytes_after"]
+    print(
+        f"Database {report['bytes_before'] / 2**20:.1f} MiB -> {report['bytes_after'] / 2**20:.1f} MiB "
+        f"({reclaimed / 2**20:.1f} MiB reclaimed)"
+    )
+
+
+if __name__ == "__main__":
+    main()
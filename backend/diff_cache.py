@@ -0,0 +1,177 @@
+"""Precomputed, compressed diffs for the files people actually open.
+
+The cubes users click are overwhelmingly the glowing ones, so ingest can store
+their before/after contents up front. Contents are compressed with zstd when
+the optional ``zstandard`` package is installed, zlib otherwise, and stored in
+``diff_blobs`` keyed by the (before, after) git blob ids, so the same change
+reached from several commits is stored once. ``/diff`` reads from here before
+falling back to git.
+"""
+
+import argparse
+import zlib
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import git
+from sqlalchemy.orm import Session
+
+from metrics import phase
+from models import DiffBlob, DiffRef, File, SessionLocal, Snapshot
+from profiling import record_phases
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_THRESHOLD = 0.8
+
+
+def compress(data: bytes) -> Tuple[str, bytes]:
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(data)
+    return "zlib", zlib.compress(data, 6)
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("diff cache entry is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def _blob(commit, path: str):
+    try:
+        return commit.tree[path]
+    except KeyError:
+        return None
+
+
+def select_paths(
+    candidates: Sequence[Tuple[int, str, float]],
+    threshold: Optional[float] = None,
+    top_k: Optional[int] = None,
+) -> List[Tuple[int, str]]:
+    """Pick (file_id, path) pairs scoring above ``threshold`` or in the top K."""
+    ranked = sorted(candidates, key=lambda c: c[2], reverse=True)
+    chosen = {}
+    if top_k:
+        for file_id, path, _ in ranked[:top_k]:
+            chosen[file_id] = path
+    if threshold is not None:
+        for file_id, path, score in ranked:
+            if score <= threshold:
+                break
+            chosen[file_id] = path
+    return list(chosen.items())
+
+
+def store_diffs(session: Session, commit, paths: Iterable[Tuple[int, str]]) -> int:
+    """Cache diffs of ``paths`` at git ``commit`` against its first parent (caller commits).
+
+    Returns the number of new compressed entries written.
+    """
+    parent = commit.parents[0] if commit.parents else None
+    written = 0
+    # Pending rows are invisible to session.get until flushed
+    added = set()
+    for file_id, path in paths:
+        if session.get(DiffRef, (commit.hexsha, file_id)) is not None:
+            continue
+        after_blob = _blob(commit, path)
+        before_blob = _blob(parent, path) if parent is not None else None
+        key = (before_blob.hexsha if before_blob else "", after_blob.hexsha if after_blob else "")
+
+        if key not in added and session.get(DiffBlob, key) is None:
+            codec, before = compress(before_blob.data_stream.read() if before_blob else b"")
+            _, after = compress(after_blob.data_stream.read() if after_blob else b"")
+            session.add(DiffBlob(blob_before=key[0], blob_after=key[1], codec=codec, before=before, after=after))
+            added.add(key)
+            written += 1
+        session.add(DiffRef(commit_id=commit.hexsha, file_id=file_id, blob_before=key[0], blob_after=key[1]))
+    session.flush()
+    return written
+
+
+def cached_diff(session: Session, commit_id: str, path: str) -> Optional[Tuple[str, str]]:
+    """Return decoded (before, after) for a cached diff, or None on a miss."""
+    row = (
+        session.query(DiffBlob)
+        .join(
+            DiffRef,
+            (DiffRef.blob_before == DiffBlob.blob_before) & (DiffRef.blob_after == DiffBlob.blob_after),
+        )
+        .join(File, DiffRef.file_id == File.id)
+        .filter(DiffRef.commit_id == commit_id, File.path == path)
+        .first()
+    )
+    if row is None:
+        return None
+    return (
+        decompress(row.codec, row.before).decode("utf-8", errors="ignore"),
+        decompress(row.codec, row.after).decode("utf-8", errors="ignore"),
+    )
+
+
+def warm(
+    session: Session,
+    repo: git.Repo,
+    threshold: Optional[float] = DEFAULT_THRESHOLD,
+    top_k: Optional[int] = None,
+    batch_size: int = 500,
+) -> Tuple[int, int]:
+    """Backfill the cache for an existing database; returns (commits, new entries)."""
+    commits = 0
+    written = 0
+    commit_ids = [row[0] for row in session.query(Snapshot.commit_id).distinct()]
+    for i, commit_id in enumerate(commit_ids, 1):
+        candidates = (
+            session.query(Snapshot.file_id, File.path, Snapshot.hotspot_score)
+            .join(File, Snapshot.file_id == File.id)
+            .filter(Snapshot.commit_id == commit_id)
+            .all()
+        )
+        paths = select_paths(candidates, threshold, top_k)
+        if not paths:
+            continue
+        try:
+            commit = repo.commit(commit_id)
+        except (ValueError, git.BadName, git.BadObject):
+            # Commit not in this clone (e.g. shallow history)
+            continue
+        with phase("diff_precompute"):
+            written += store_diffs(session, commit, paths)
+        commits += 1
+        if i % batch_size == 0:
+            session.commit()
+    session.commit()
+    return commits, written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill the precomputed diff cache")
+    parser.add_argument("--repo", required=True, help="Path to the git repository")
+    parser.add_argument("--db-url", default="sqlite:///timewarp.db", help="Database URL")
+    parser.add_argument(
+        "--threshold", type=float, help=f"Cache files scoring above this (default {DEFAULT_THRESHOLD} without --top-k)"
+    )
+    parser.add_argument("--top-k", type=int, help="Cache the K highest-scoring files of every commit")
+    args = parser.parse_args()
+
+    threshold = args.threshold
+    # Either option alone selects only that way; both together take the union
+    if threshold is None and not args.top_k:
+        threshold = DEFAULT_THRESHOLD
+
+    session = SessionLocal(args.db_url)
+    try:
+        with record_phases(args.db_url):
+            commits, written = warm(session, git.Repo(args.repo), threshold, args.top_k)
+        print(f"Cached diffs for {commits} commits ({written} new entries)")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
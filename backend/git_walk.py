@@ -0,0 +1,277 @@
+"""Streaming, filterable commit walk shared by the ingesters.
+
+``CommitWalker`` yields commits oldest-first straight from a ``git rev-list``
+pipe, so memory stays flat however long the history is. Include/exclude globs
+are pushed down to git as pathspecs and applied again to per-commit changes
+and tree traversal, so a monorepo can be ingested one subtree at a time.
+"""
+
+import re
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+from git import Commit, Repo
+
+_GLOB_CHARS = re.compile(r"[*?\[]")
+
+
+_POSIX_CLASSES = {
+    "alnum": "a-zA-Z0-9",
+    "alpha": "a-zA-Z",
+    "blank": " \\t",
+    "digit": "0-9",
+    "lower": "a-z",
+    "punct": re.escape("!\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~"),
+    "space": " \\t\\n\\r\\f\\v",
+    "upper": "A-Z",
+    "xdigit": "0-9A-Fa-f",
+}
+
+
+def _bracket(pattern: str, i: int) -> Tuple[Optional[str], int]:
+    """Translate the ``[...]`` class starting at ``pattern[i]`` as git's wildmatch does.
+
+    Returns the regex and the index after the class, or (None, i) when the
+    bracket is never closed and so stands for itself.
+    """
+    j = i + 1
+    negate = j < len(pattern) and pattern[j] in "!^"
+    if negate:
+        j += 1
+    parts = []
+    first = True
+    while j < len(pattern):
+        c = pattern[j]
+        if c == "]" and not first:
+            # Like "*", a class never matches the directory separator
+            body = "".join(parts)
+            return ("[^/" + body + "]" if negate else "(?!/)[" + body + "]"), j + 1
+        if c == "[" and pattern.startswith("[:", j):
+            end = pattern.find(":]", j + 2)
+            name = pattern[j + 2 : end] if end != -1 else None
+            if name not in _POSIX_CLASSES:
+                raise ValueError(f"unsupported character class in glob: {pattern!r}")
+            parts.append(_POSIX_CLASSES[name])
+            j = end + 2
+        elif c == "\\" and j + 1 < len(pattern):
+            parts.append(re.escape(pattern[j + 1]))
+            j += 2
+        elif c == "-" and parts and j + 1 < len(pattern) and pattern[j + 1] != "]":
+            parts.append("-")
+            j += 1
+        else:
+            parts.append(re.escape(c))
+            j += 1
+        first = False
+    return None, i
+
+
+def _compile_glob(pattern: str) -> "re.Pattern[str]":
+    """Translate a git-style glob (``**`` crosses directories) to a regex.
+
+    Follows git's ``:(glob)`` pathspec rules, which the same pattern is
+    passed to, including ``[...]`` classes and backslash escapes. A pattern
+    also matches everything below a matching directory, so ``services/api``
+    selects ``services/api/main.py``.
+    """
+    pattern = pattern.strip("/")
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            regex += "[^/]"
+            i += 1
+        elif pattern[i] == "[":
+            translated, end = _bracket(pattern, i)
+            if translated is None:
+                regex += re.escape("[")
+                i += 1
+            else:
+                regex += translated
+                i = end
+        elif pattern[i] == "\\" and i + 1 < len(pattern):
+            regex += re.escape(pattern[i + 1])
+            i += 2
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return re.compile(regex + "(?:/.*)?")
+
+
+def _literal_prefix(pattern: str) -> str:
+    """Directory part of ``pattern`` before its first wildcard."""
+    pattern = pattern.strip("/")
+    match = _GLOB_CHARS.search(pattern)
+    if match is None:
+        return pattern
+    return pattern[: match.start()].rpartition("/")[0]
+
+
+class CommitWalker:
+    """Walk a repository's history oldest-first with optional filters."""
+
+    def __init__(
+        self,
+        repo: Repo,
+        include: Sequence[str] = (),
+        exclude: Sequence[str] = (),
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        first_parent: bool = False,
+        skip_merges: bool = False,
+        cache_size: int = 256,
+    ):
+        self.repo = repo
+        self.include = list(include or ())
+        self.exclude = list(exclude or ())
+        self.since = since
+        self.until = until
+        self.first_parent = first_parent
+        self.skip_merges = skip_merges
+        self._include_res = [_compile_glob(p) for p in self.include]
+        self._exclude_res = [_compile_glob(p) for p in self.exclude]
+        self._cache_size = cache_size
+        # hexsha -> (path -> churn, new path -> old path); bounded LRU
+        self._changes_cache: "OrderedDict[str, Tuple[Dict[str, int], Dict[str, str]]]" = OrderedDict()
+
+    def matches(self, path: str) -> bool:
+        if self._include_res and not any(r.fullmatch(path) for r in self._include_res):
+            return False
+        return not any(r.fullmatch(path) for r in self._exclude_res)
+
+    def _rev_list_args(self, rev: str) -> list:
+        args = ["--reverse"]
+        if self.first_parent:
+            args.append("--first-parent")
+        if self.skip_merges:
+            args.append("--no-merges")
+        if self.since:
+            args.append(f"--since={self.since}")
+        if self.until:
+            args.append(f"--until={self.until}")
+        args.append(rev)
+        pathspecs = [f":(glob){p}" for p in self.include]
+        pathspecs += [f":(glob,exclude){p}" for p in self.exclude]
+        if pathspecs:
+            args.append("--")
+            args.extend(pathspecs)
+        return args
+
+    def commits(self, rev: str = "HEAD") -> Iterator[Commit]:
+        """Yield commits oldest-first, reading shas from git as they arrive."""
+        proc = self.repo.git.rev_list(*self._rev_list_args(rev), as_process=True)
+        try:
+            for line in proc.stdout:
+                sha = line.strip().decode("ascii")
+                if sha:
+                    yield self.repo.commit(sha)
+            proc.wait()
+        finally:
+            if proc.proc is not None and proc.proc.poll() is None:
+                proc.proc.kill()
+                proc.proc.wait()
+
+    def _load_changes(self, commit: Commit) -> Tuple[Dict[str, int], Dict[str, str]]:
+        # Same base as Commit.stats (first parent), but with rename detection
+        if commit.parents:
+            raw = self.repo.git.diff_tree(
+                "-r", "-M", "--numstat", "-z", "--no-commit-id", commit.parents[0].hexsha, commit.hexsha
+            )
+        else:
+            raw = self.repo.git.diff_tree("-r", "-M", "--numstat", "-z", "--no-commit-id", "--root", commit.hexsha)
+
+        changes: Dict[str, int] = {}
+        renames: Dict[str, str] = {}
+        tokens = raw.split("\0")
+        i = 0
+        while i < len(tokens):
+            entry = tokens[i]
+            i += 1
+            if not entry.strip():
+                continue
+            added, deleted, path = entry.split("\t", 2)
+            if not path:
+                # Rename: "added\tdeleted\t\0old\0new"
+                old_path, path = tokens[i], tokens[i + 1]
+                i += 2
+                if self.matches(path):
+                    renames[path] = old_path
+            if not self.matches(path):
+                continue
+            # Binary files report "-" for line counts
+            churn = (int(added) if added != "-" else 0) + (int(deleted) if deleted != "-" else 0)
+            changes[path] = churn
+        return changes, renames
+
+    def _cached(self, commit: Commit) -> Tuple[Dict[str, int], Dict[str, str]]:
+        entry = self._changes_cache.get(commit.hexsha)
+        if entry is not None:
+            self._changes_cache.move_to_end(commit.hexsha)
+            return entry
+        entry = self._load_changes(commit)
+        self._changes_cache[commit.hexsha] = entry
+        if len(self._changes_cache) > self._cache_size:
+            self._changes_cache.popitem(last=False)
+        return entry
+
+    def changes(self, commit: Commit) -> Dict[str, int]:
+        """Changed paths in ``commit`` that pass the filters, mapped to churn."""
+        return self._cached(commit)[0]
+
+    def renames(self, commit: Commit) -> Dict[str, str]:
+        """Renamed paths in ``commit``, mapped new path -> old path."""
+        return self._cached(commit)[1]
+
+    def _excluded_tree(self, item, depth) -> bool:
+        return item.type == "tree" and any(r.fullmatch(item.path) for r in self._exclude_res)
+
+    def blobs(self, commit: Commit) -> Iterator:
+        """Yield matching blobs of ``commit``'s tree, skipping excluded subtrees."""
+        roots = sorted({_literal_prefix(p) for p in self.include}) if self.include else [""]
+        if "" in roots:
+            roots = [""]
+        # Drop roots nested under another root so no blob is yielded twice
+        roots = [r for r in roots if not any(o and r != o and r.startswith(o + "/") for o in roots)]
+        for root in roots:
+            try:
+                tree = commit.tree[root] if root else commit.tree
+            except KeyError:
+                continue
+            if tree.type == "blob":
+                if self.matches(tree.path):
+                    yield tree
+                continue
+            for item in tree.traverse(prune=self._excluded_tree):
+                if item.type == "blob" and self.matches(item.path):
+                    yield item
+
+
+def add_walk_arguments(parser) -> None:
+    """Register the commit-walk options on an argparse parser."""
+    parser.add_argument("--include", action="append", default=[], metavar="GLOB", help="Only ingest paths matching GLOB (repeatable)")
+    parser.add_argument("--exclude", action="append", default=[], metavar="GLOB", help="Skip paths matching GLOB (repeatable)")
+    parser.add_argument("--since", help="Only commits after this date (any format git accepts)")
+    parser.add_argument("--until", help="Only commits before this date (any format git accepts)")
+    parser.add_argument("--first-parent", action="store_true", help="Follow only the first parent of merges")
+    parser.add_argument("--no-merges", action="store_true", help="Skip merge commits")
+
+
+def walk_options(args) -> dict:
+    """CommitWalker keyword arguments from parsed ``add_walk_arguments`` options."""
+    return {
+        "include": args.include,
+        "exclude": args.exclude,
+        "since": args.since,
+        "until": args.until,
+        "first_parent": args.first_parent,
+        "skip_merges": args.no_merges,
+    }
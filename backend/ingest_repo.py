@@ -4,24 +4,41 @@ import argparse
 from datetime import datetime
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from diff_cache import select_paths, store_diffs
+from git_walk import CommitWalker, add_walk_arguments, walk_options
+from layout import assign_layout, ensure_layouts
+from metrics import phase
 from models import Base, Commit, File, Snapshot, SessionLocal
 from ml.feature_utils import compute_features, bugfix_commit
 from ml.real_hotspot import predict
+from profiling import profile_run, record_phases
 
 
 class RepoIngester:
     def __init__(self, db_url="sqlite:///timewarp.db"):
         self.session = SessionLocal(db_url)
 
-    def ingest_repository(self, repo_path):
+    def ingest_repository(self, repo_path, diff_threshold=None, diff_top_k=None, **walk_options):
+        """Ingest history oldest-first; ``walk_options`` go to CommitWalker.
+
+        With ``diff_threshold`` and/or ``diff_top_k``, diffs of each commit's
+        highest-scoring files are precomputed into the diff cache.
+        """
         repo = git.Repo(repo_path)
-        commits = list(repo.iter_commits("HEAD"))
-        commits.reverse()  # oldest to newest
+        walker = CommitWalker(repo, **walk_options)
+        ensure_layouts(self.session)
+        commits = walker.commits()
+        with phase("git_extraction"):
+            commit = next(commits, None)
 
         total_commits = 0
         total_snapshots = 0
 
-        for i, commit in enumerate(commits):
+        while commit is not None:
+            # One commit of lookahead for labels; memory stays constant
+            with phase("git_extraction"):
+                next_commit = next(commits, None)
+
             # Insert commit if not exists
             existing_commit = (
                 self.session.query(Commit).filter(Commit.id == commit.hexsha).first()
@@ -34,33 +51,51 @@ class RepoIngester:
                     message=commit.message,
                 )
                 self.session.add(db_commit)
-                self.session.commit()
+                with phase("db_writes"):
+                    self.session.commit()
                 total_commits += 1
 
             # Only process files changed in this commit to avoid inflating snapshots
-            changed_paths = list(commit.stats.files.keys())
-            for path in changed_paths:
+            with phase("git_extraction"):
+                changes = walker.changes(commit)
+                renames = walker.renames(commit)
+            scored = []
+            for path, churn in changes.items():
                 # Ensure File row exists
                 file = self.session.query(File).filter(File.path == path).first()
                 if not file:
                     file = File(path=path)
                     self.session.add(file)
-                    self.session.commit()
+                    self.session.flush()
+                    assign_layout(self.session, file)
+                    with phase("db_writes"):
+                        self.session.commit()
                     file = self.session.query(File).filter(File.path == path).first()
 
-                # Calculate churn from git stats (insertions + deletions)
-                stats = commit.stats.files.get(path, {"insertions": 0, "deletions": 0})
-                churn = int(stats.get("insertions", 0)) + int(stats.get("deletions", 0))
+                # A renamed file keeps the edit history of its previous path
+                history_file = file
+                if path in renames:
+                    history_file = (
+                        self.session.query(File).filter(File.path == renames[path]).first() or file
+                    )
 
                 # Compute features and predict hotspot score
-                features = compute_features(self.session, file.id, commit.committed_date, churn, path)
-                hotspot_score = predict(features)
+                with phase("feature_computation"):
+                    features = compute_features(
+                        self.session, history_file.id, commit.committed_date, churn, path
+                    )
+                with phase("inference"):
+                    hotspot_score = predict(features)
 
                 # Determine label by looking ahead to next commit
                 label = 0
-                if i < len(commits) - 1:
-                    next_commit = commits[i + 1]
-                    if path in next_commit.stats.files:
+                if next_commit is not None:
+                    with phase("git_extraction"):
+                        touched_next = (
+                            path in walker.changes(next_commit)
+                            or path in walker.renames(next_commit).values()
+                        )
+                    if touched_next:
                         label = 1 if bugfix_commit(next_commit.message) else 0
 
                 # Insert snapshot, including cached features for training
@@ -73,9 +108,16 @@ class RepoIngester:
                     tmp_features=features,
                 )
                 self.session.add(snapshot)
+                scored.append((file.id, path, hotspot_score))
                 total_snapshots += 1
 
-            self.session.commit()
+            if diff_threshold is not None or diff_top_k:
+                with phase("diff_precompute"):
+                    store_diffs(self.session, commit, select_paths(scored, diff_threshold, diff_top_k))
+
+            with phase("db_writes"):
+                self.session.commit()
+            commit = next_commit
 
         print(f"{total_commits} commits, {total_snapshots} snapshots")
 
@@ -87,8 +129,15 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Ingest a git repository into the database")
     parser.add_argument("--repo", required=True, help="Path to the git repository")
     parser.add_argument("--db-url", default="sqlite:///timewarp.db", help="Database URL")
+    parser.add_argument("--profile", metavar="DIR", help="Write a cProfile report, per-phase timings and peak memory to DIR")
+    parser.add_argument("--diff-threshold", type=float, help="Precompute diffs for files scoring above this (e.g. 0.8)")
+    parser.add_argument("--diff-top-k", type=int, help="Precompute diffs for the K highest-scoring files of each commit")
+    add_walk_arguments(parser)
     args = parser.parse_args()
     
     ingester = RepoIngester(args.db_url)
-    ingester.ingest_repository(args.repo)
+    with record_phases(args.db_url), profile_run(args.profile, "ingest_repo"):
+        ingester.ingest_repository(
+            args.repo, diff_threshold=args.diff_threshold, diff_top_k=args.diff_top_k, **walk_options(args)
+        )
     ingester.close()
@@ -0,0 +1,152 @@
+"""Stable, incrementally assigned 3D layout for repository files.
+
+Each top-level directory gets a cluster centre and each file a slot inside its
+cluster, both in order of first appearance. Positions come from Vogel
+(golden-angle) spirals, which place point N without moving points 0..N-1, so a
+file's coordinate never changes once assigned and clients can cache it.
+
+Cluster centres are only ``DIRECTORY_SPACING`` apart, so a cluster holds at
+most ``CLUSTER_CAPACITY`` files. A directory that outgrows it continues in a
+new cluster at the next free centre instead of spreading into its neighbours.
+Spiral indexes inside a cluster only ever grow, so a file added after
+``compact.py`` deleted others never lands on a position still in use.
+"""
+
+import argparse
+import math
+from typing import Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import File, FileLayout, SessionLocal
+
+GOLDEN_ANGLE = math.pi * (3 - math.sqrt(5))
+DIRECTORY_SPACING = 30.0
+FILE_SPACING = 2.2
+LEVEL_DEPTH = 2.0
+MAX_LEVELS = 5
+# Adjacent centres can be DIRECTORY_SPACING apart; leave room for the largest cube (3.2)
+CLUSTER_RADIUS = DIRECTORY_SPACING / 2 - 2.0
+CLUSTER_CAPACITY = int((CLUSTER_RADIUS / FILE_SPACING) ** 2) + 1
+
+
+def top_directory(path: str) -> str:
+    return path.split("/", 1)[0] if "/" in path else "root"
+
+
+def _spiral_point(index: int, spacing: float) -> Tuple[float, float]:
+    radius = spacing * math.sqrt(index)
+    angle = index * GOLDEN_ANGLE
+    return radius * math.cos(angle), radius * math.sin(angle)
+
+
+def position(directory_index: int, slot: int, path: str) -> Tuple[float, float, float]:
+    """Coordinate for the ``slot``-th file of the ``directory_index``-th cluster."""
+    cx, cy = _spiral_point(directory_index, DIRECTORY_SPACING)
+    dx, dy = _spiral_point(slot, FILE_SPACING)
+    # Deeper files sit further back, so nesting reads as depth
+    depth = min(path.count("/"), MAX_LEVELS)
+    return cx + dx, cy + dy, -LEVEL_DEPTH * depth
+
+
+def _next_cluster_slot(session: Session, directory_index: int) -> int:
+    # MAX rather than COUNT: rows deleted by compaction leave gaps that must stay unused
+    last = (
+        session.query(func.max(FileLayout.cluster_slot))
+        .filter(FileLayout.directory_index == directory_index)
+        .scalar()
+    )
+    return 0 if last is None else last + 1
+
+
+def backfill_cluster_slots(session: Session) -> int:
+    """Recover the spiral index of rows written before ``cluster_slot`` existed.
+
+    Point N of a spiral sits ``FILE_SPACING * sqrt(N)`` from the centre, so
+    the index follows from the stored coordinates. Caller commits.
+    """
+    rows = session.query(FileLayout).filter(FileLayout.cluster_slot.is_(None)).all()
+    for layout in rows:
+        cx, cy = _spiral_point(layout.directory_index, DIRECTORY_SPACING)
+        distance_sq = (layout.x - cx) ** 2 + (layout.y - cy) ** 2
+        layout.cluster_slot = round(distance_sq / FILE_SPACING**2)
+    session.flush()
+    return len(rows)
+
+
+def assign_layout(session: Session, file: File) -> FileLayout:
+    """Give ``file`` a permanent position if it has none yet (caller commits)."""
+    layout = session.get(FileLayout, file.id)
+    if layout is not None:
+        return layout
+
+    directory = top_directory(file.path)
+    last_slot = (
+        session.query(func.max(FileLayout.slot)).filter(FileLayout.directory == directory).scalar()
+    )
+    directory_index = None
+    if last_slot is not None:
+        # The directory's newest cluster is the one its last file went into
+        current = (
+            session.query(FileLayout.directory_index)
+            .filter(FileLayout.directory == directory, FileLayout.slot == last_slot)
+            .scalar()
+        )
+        cluster_slot = _next_cluster_slot(session, current)
+        if cluster_slot < CLUSTER_CAPACITY:
+            directory_index = current
+        slot = last_slot + 1
+    else:
+        slot = 0
+    if directory_index is None:
+        last = session.query(func.max(FileLayout.directory_index)).scalar()
+        directory_index = 0 if last is None else last + 1
+        cluster_slot = _next_cluster_slot(session, directory_index)
+
+    x, y, z = position(directory_index, cluster_slot, file.path)
+    layout = FileLayout(
+        file_id=file.id,
+        directory=directory,
+        directory_index=directory_index,
+        slot=slot,
+        cluster_slot=cluster_slot,
+        x=x,
+        y=y,
+        z=z,
+    )
+    session.add(layout)
+    session.flush()
+    return layout
+
+
+def ensure_layouts(session: Session) -> int:
+    """Assign positions to files that predate the layout table; returns count."""
+    backfill_cluster_slots(session)
+    missing = (
+        session.query(File)
+        .outerjoin(FileLayout, FileLayout.file_id == File.id)
+        .filter(FileLayout.file_id.is_(None))
+        .order_by(File.id)
+        .all()
+    )
+    for file in missing:
+        assign_layout(session, file)
+    session.commit()
+    return len(missing)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill stable file layout coordinates")
+    parser.add_argument("--db-url", default="sqlite:///timewarp.db", help="Database URL")
+    args = parser.parse_args()
+
+    session = SessionLocal(args.db_url)
+    try:
+        print(f"Assigned layout to {ensure_layouts(session)} files")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
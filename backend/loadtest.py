@@ -0,0 +1,149 @@
+"""Measure API throughput as the number of server workers grows.
+
+For each worker count, starts ``server.py`` on a local port, drives it from
+several client processes with keep-alive connections for a fixed time, and
+reports requests/second and latency percentiles. Requests cycle through
+/snapshot for the most recent commits, with an optional share of /diff for
+their hottest file. The client processes share the machine with the server,
+so give it spare cores.
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from urllib.parse import quote
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _get(conn, path: str):
+    conn.request("GET", path)
+    response = conn.getresponse()
+    return response.status, response.read()
+
+
+def _wait_ready(port: int, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            status, _ = _get(conn, "/timeline?page_size=1")
+            conn.close()
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not become ready")
+
+
+def _request_paths(port: int, commits: int, diff_share: float) -> list:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    _, body = _get(conn, "/timeline?page=1&page_size=1000")
+    ids = [c["id"] for c in json.loads(body)][-commits:]
+    paths = []
+    for commit_id in ids:
+        paths.append(f"/snapshot/{commit_id}")
+        if diff_share > 0:
+            status, body = _get(conn, f"/snapshot/{commit_id}")
+            files = json.loads(body) if status == 200 else []
+            if files:
+                hottest = max(files, key=lambda f: f["hotspot_score"])
+                paths.append(f"/diff/{commit_id}/{quote(hottest['path'])}")
+    conn.close()
+    if diff_share <= 0:
+        return paths
+    snapshots = [p for p in paths if p.startswith("/snapshot/")]
+    diffs = [p for p in paths if p.startswith("/diff/")]
+    n_diff = int(len(snapshots) * diff_share / max(1e-9, 1 - diff_share))
+    return snapshots + (diffs * (n_diff // max(1, len(diffs)) + 1))[:n_diff]
+
+
+def _client(port: int, paths: list, duration: float, offset: int, queue) -> None:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    latencies = []
+    errors = 0
+    i = offset
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        start = time.perf_counter()
+        try:
+            status, _ = _get(conn, paths[i % len(paths)])
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            status = 0
+        latencies.append(time.perf_counter() - start)
+        if status != 200:
+            errors += 1
+        i += 1
+    conn.close()
+    queue.put((latencies, errors))
+
+
+def run(workers: int, port: int, clients: int, duration: float, commits: int, diff_share: float) -> dict:
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BACKEND_DIR, "server.py"), "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--warm", str(commits)],
+        cwd=BACKEND_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_ready(port, timeout=60)
+        paths = _request_paths(port, commits, diff_share)
+        if not paths:
+            raise RuntimeError("database has no commits to request")
+        queue = multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(target=_client, args=(port, paths, duration, i * 7, queue))
+            for i in range(clients)
+        ]
+        for p in procs:
+            p.start()
+        results = [queue.get() for _ in procs]
+        for p in procs:
+            p.join()
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    latencies = sorted(l for r in results for l in r[0])
+    return {
+        "workers": workers,
+        "requests": len(latencies),
+        "errors": sum(r[1] for r in results),
+        "rps": len(latencies) / duration,
+        "p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the API at several worker counts")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts to try")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent client processes")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per worker count")
+    parser.add_argument("--commits", type=int, default=50, help="Most recent commits to request")
+    parser.add_argument("--diff-share", type=float, default=0.0, help="Fraction of requests that hit /diff")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, {args.clients} clients, {args.duration:.0f}s per run")
+    baseline = None
+    for workers in args.workers:
+        r = run(workers, args.port, args.clients, args.duration, args.commits, args.diff_share)
+        baseline = baseline or r["rps"]
+        print(
+            f"workers={r['workers']:>2}  {r['rps']:8.1f} req/s  x{r['rps'] / baseline:4.2f}  "
+            f"p50 {r['p50_ms']:6.1f} ms  p99 {r['p99_ms']:6.1f} ms  errors {r['errors']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
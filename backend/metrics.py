@@ -0,0 +1,427 @@
+"""In-process metrics with Prometheus text exposition.
+
+Metrics are plain counters and histograms guarded by a lock each, cheap enough
+to leave enabled on every request. ``render()`` produces the text format served
+by the API's ``/metrics`` endpoint.
+
+With several uvicorn workers each process only sees its own requests, so a
+scrape would land on one worker at random. ``start_exporter`` has every worker
+write its values to ``metrics-<pid>.json`` in a shared directory, and
+``render(workers_dir=...)`` sums those files with the answering worker's live
+values.
+"""
+
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_registry: List["_Metric"] = []
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), register: bool = True):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        if register:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def copy(self, copies: Dict["_Metric", "_Metric"]) -> "_Metric":
+        """An empty, unregistered metric of the same shape, for merging worker values."""
+        raise NotImplementedError
+
+    def dump(self) -> Optional[list]:
+        """JSON-serialisable values, or None for metrics derived from others."""
+        return None
+
+    def load(self, data: list) -> None:
+        """Add values from another process's ``dump()``."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing value, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), register: bool = True):
+        super().__init__(name, documentation, labelnames, register)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def copy(self, copies: Dict[_Metric, _Metric]) -> "Counter":
+        return Counter(self.name, self.documentation, self.labelnames, register=False)
+
+    def dump(self) -> list:
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def load(self, data: list) -> None:
+        with self._lock:
+            for key, value in data:
+                key = tuple(key)
+                self._values[key] = self._values.get(key, 0.0) + value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram, optionally split by labels."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        register: bool = True,
+    ):
+        super().__init__(name, documentation, labelnames, register)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = ([0] * (len(self.buckets) + 1), [0.0])
+                self._values[key] = entry
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return sum(entry[0]) if entry else 0
+
+    def copy(self, copies: Dict[_Metric, _Metric]) -> "Histogram":
+        return Histogram(self.name, self.documentation, self.labelnames, self.buckets, register=False)
+
+    def dump(self) -> list:
+        with self._lock:
+            return [[list(key), list(counts), total[0]] for key, (counts, total) in self._values.items()]
+
+    def load(self, data: list) -> None:
+        with self._lock:
+            for key, counts, total in data:
+                if len(counts) != len(self.buckets) + 1:
+                    # Written by a worker running different bucket bounds
+                    continue
+                entry = self._values.setdefault(tuple(key), ([0] * (len(self.buckets) + 1), [0.0]))
+                for i, count in enumerate(counts):
+                    entry[0][i] += count
+                entry[1][0] += total
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+                )
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _CacheRatio(_Metric):
+    """Gauge derived from the cache hit/miss counter at render time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, source: Counter, register: bool = True):
+        super().__init__(name, documentation, ("cache",), register)
+        self._source = source
+
+    def copy(self, copies: Dict[_Metric, _Metric]) -> "_CacheRatio":
+        return _CacheRatio(self.name, self.documentation, copies[self._source], register=False)
+
+    def samples(self) -> List[str]:
+        totals: Dict[str, List[float]] = {}
+        with self._source._lock:
+            for (cache, result), value in self._source._values.items():
+                entry = totals.setdefault(cache, [0.0, 0.0])
+                entry[0 if result == "hit" else 1] += value
+        lines = []
+        for cache, (hits, misses) in sorted(totals.items()):
+            ratio = hits / (hits + misses) if hits + misses else 0.0
+            lines.append(f"{self.name}{_format_labels(self.labelnames, (cache,))} {_format_value(ratio)}")
+        return lines
+
+
+http_request_duration = Histogram(
+    "timewarp_http_request_duration_seconds",
+    "HTTP request latency by route.",
+    ("method", "route"),
+)
+http_requests = Counter(
+    "timewarp_http_requests_total",
+    "HTTP requests by route and status code.",
+    ("method", "route", "status"),
+)
+http_request_db_queries = Histogram(
+    "timewarp_http_request_db_queries",
+    "SQL statements executed per HTTP request.",
+    ("route",),
+    buckets=COUNT_BUCKETS,
+)
+http_request_db_seconds = Histogram(
+    "timewarp_http_request_db_seconds",
+    "Time spent in SQL statements per HTTP request.",
+    ("route",),
+)
+slow_requests = Counter(
+    "timewarp_slow_requests_total",
+    "Requests over the profiling threshold, by whether a profile was kept.",
+    ("route", "profiled"),
+)
+db_queries = Counter("timewarp_db_queries_total", "SQL statements executed.")
+db_query_seconds = Counter("timewarp_db_query_seconds_total", "Time spent executing SQL statements.")
+git_objects_read = Counter(
+    "timewarp_git_objects_read_total", "Git blobs read from the object store.", ("endpoint",)
+)
+git_bytes_read = Counter(
+    "timewarp_git_bytes_read_total", "Bytes of git blob content read.", ("endpoint",)
+)
+cache_requests = Counter(
+    "timewarp_cache_requests_total", "Cache lookups by cache and result.", ("cache", "result")
+)
+cache_hit_ratio = _CacheRatio(
+    "timewarp_cache_hit_ratio", "Fraction of cache lookups that hit.", cache_requests
+)
+# Ingest phases run in the command-line tools, not the API process, so these
+# stay out of the registry; profiling.record_phases persists them for /metrics
+ingest_phase_calls = Counter(
+    "timewarp_ingest_phase_calls_total", "Number of times each ingest phase ran.", ("phase",), register=False
+)
+ingest_phase_seconds = Counter(
+    "timewarp_ingest_phase_seconds_total", "Wall time spent in each ingest phase.", ("phase",), register=False
+)
+ingest_phase_cpu_seconds = Counter(
+    "timewarp_ingest_phase_cpu_seconds_total", "CPU time spent in each ingest phase.", ("phase",), register=False
+)
+
+# Per-request SQL accumulator: [statement count, seconds]; None outside requests
+_request_db_stats: ContextVar[Optional[List[float]]] = ContextVar("_request_db_stats", default=None)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    cache_requests.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def record_git_read(endpoint: str, data: bytes) -> None:
+    git_objects_read.inc(endpoint=endpoint)
+    git_bytes_read.inc(len(data), endpoint=endpoint)
+
+
+@contextmanager
+def phase(name: str):
+    """Time a block of ingest work under ``timewarp_ingest_phase_*``."""
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        ingest_phase_seconds.inc(time.perf_counter() - start, phase=name)
+        ingest_phase_cpu_seconds.inc(time.process_time() - cpu_start, phase=name)
+        ingest_phase_calls.inc(phase=name)
+
+
+def phase_totals() -> Dict[str, Tuple[int, float, float]]:
+    """Return ``{phase: (calls, wall seconds, cpu seconds)}`` recorded so far."""
+    with ingest_phase_calls._lock:
+        calls = dict(ingest_phase_calls._values)
+    return {
+        key[0]: (int(count), ingest_phase_seconds.get(phase=key[0]), ingest_phase_cpu_seconds.get(phase=key[0]))
+        for key, count in calls.items()
+    }
+
+
+def begin_request() -> object:
+    """Start accumulating SQL statistics for the current request context."""
+    return _request_db_stats.set([0, 0.0])
+
+
+def end_request(token: object) -> Tuple[int, float]:
+    stats = _request_db_stats.get() or [0, 0.0]
+    _request_db_stats.reset(token)
+    return int(stats[0]), float(stats[1])
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("_metrics_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("_metrics_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    db_queries.inc()
+    db_query_seconds.inc(elapsed)
+    stats = _request_db_stats.get()
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += elapsed
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("_metrics_start"):
+        conn.info["_metrics_start"].pop()
+
+
+def instrument_engine(engine) -> None:
+    """Count and time every SQL statement executed on ``engine``."""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+def _worker_path(directory: str, pid: int) -> str:
+    return os.path.join(directory, f"metrics-{pid}.json")
+
+
+def _state() -> Dict[str, list]:
+    dumps = {metric.name: metric.dump() for metric in _registry}
+    return {name: data for name, data in dumps.items() if data is not None}
+
+
+def export(directory: str) -> None:
+    """Write this process's values to ``directory`` for other workers to merge."""
+    state = _state()
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, _worker_path(directory, os.getpid()))
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+def start_exporter(directory: str, interval: float = 5.0) -> threading.Thread:
+    """Export every ``interval`` seconds from a daemon thread, so idle workers stay counted."""
+
+    def run():
+        while True:
+            export(directory)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="metrics-exporter", daemon=True)
+    thread.start()
+    return thread
+
+
+def _merged(directory: str) -> List[_Metric]:
+    copies: Dict[_Metric, _Metric] = {}
+    for metric in _registry:
+        copies[metric] = metric.copy(copies)
+    by_name = {metric.name: copies[metric] for metric in _registry}
+    # This worker's live values, then every other worker's last export; files
+    # of exited workers stay until server.py clears the directory, so totals
+    # never go backwards when uvicorn replaces a worker
+    states = [_state()]
+    own = _worker_path(directory, os.getpid())
+    for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+        if path == own:
+            continue
+        try:
+            with open(path) as f:
+                states.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    for state in states:
+        for name, data in state.items():
+            if name in by_name:
+                by_name[name].load(data)
+    return [copies[metric] for metric in _registry]
+
+
+def render(
+    phases: Optional[Dict[str, Tuple[int, float, float]]] = None, workers_dir: Optional[str] = None
+) -> str:
+    """Render every registered metric, plus ingest ``phases`` totals when given.
+
+    ``phases`` has the shape of ``phase_totals()`` and comes from whatever the
+    ingest commands persisted, since this process never runs them. With
+    ``workers_dir``, values are summed over every worker exporting there.
+    """
+    exported = _merged(workers_dir) if workers_dir else list(_registry)
+    if phases is not None:
+        for index, source in enumerate((ingest_phase_calls, ingest_phase_seconds, ingest_phase_cpu_seconds)):
+            counter = Counter(source.name, source.documentation, source.labelnames, register=False)
+            for name, totals in phases.items():
+                counter.inc(totals[index], phase=name)
+            exported.append(counter)
+    return "\n".join(metric.render() for metric in exported) + "\n"
@@ -0,0 +1,99 @@
+"""Compare cold-start cost of torch and NumPy hotspot inference.
+
+Each path runs in a fresh interpreter: import, load weights, score one vector.
+Reports wall time and max RSS, then checks both paths agree on random inputs.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_SNIPPETS = {
+    "torch": """
+import torch
+from pathlib import Path
+from ml.train_hotspot import HotspotNet
+model = HotspotNet()
+model.load_state_dict(torch.load(Path("ml/hotspot_model.pt"), map_location="cpu"))
+model.eval()
+with torch.no_grad():
+    model(torch.tensor([3.0, 2.0, 0.0, 86400.0]).unsqueeze(0)).item()
+""",
+    "numpy": """
+from ml.real_hotspot import predict
+predict([3.0, 2.0, 0.0, 86400.0])
+""",
+}
+
+_HARNESS = """
+import json, resource, sys, time
+start = time.perf_counter()
+exec(sys.argv[1])
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  "torch_loaded": "torch" in sys.modules}))
+"""
+
+
+def measure(path: str, runs: int) -> dict:
+    results = []
+    for _ in range(runs):
+        out = subprocess.check_output(
+            [sys.executable, "-c", _HARNESS, _SNIPPETS[path]], cwd=BACKEND_DIR
+        )
+        results.append(json.loads(out))
+    return {
+        "seconds": min(r["seconds"] for r in results),
+        "max_rss_mb": min(r["max_rss_mb"] for r in results),
+        "torch_loaded": results[0]["torch_loaded"],
+    }
+
+
+def max_abs_difference(samples: int) -> float:
+    import numpy as np
+    import torch
+
+    sys.path.insert(0, BACKEND_DIR)
+    from ml.real_hotspot import MODEL_PATH, predict
+    from ml.train_hotspot import HotspotNet
+
+    model = HotspotNet()
+    model.load_state_dict(torch.load(MODEL_PATH, map_location="cpu"))
+    model.eval()
+
+    rng = np.random.default_rng(0)
+    X = np.column_stack(
+        [
+            rng.integers(0, 2000, samples),
+            rng.integers(1, 12, samples),
+            rng.integers(0, 2, samples),
+            rng.uniform(0, 3e7, samples),
+        ]
+    ).astype(np.float32)
+    with torch.no_grad():
+        expected = model(torch.from_numpy(X)).squeeze(1).numpy()
+    actual = np.array([predict(row.tolist()) for row in X], dtype=np.float32)
+    return float(np.max(np.abs(expected - actual)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hotspot inference cold start")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters per path")
+    parser.add_argument("--samples", type=int, default=10000, help="Vectors for the equivalence check")
+    args = parser.parse_args()
+
+    for path in ("torch", "numpy"):
+        r = measure(path, args.runs)
+        print(
+            f"{path:>6}: cold start {r['seconds'] * 1000:8.1f} ms, max RSS {r['max_rss_mb']:7.1f} MiB, "
+            f"torch imported: {r['torch_loaded']}"
+        )
+    print(f"max |torch - numpy| over {args.samples} vectors: {max_abs_difference(args.samples):.3g}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,45 @@
-import torch
-from torch import tensor, no_grad
-from torch.nn import Module
 from pathlib import Path
-from .train_hotspot import HotspotNet
+from typing import Optional, Tuple
+
+import numpy as np
+
+MODEL_PATH = Path(__file__).with_name("hotspot_model.pt")
+# Plain NumPy export of the same weights so inference never needs torch
+WEIGHTS_PATH = Path(__file__).with_name("hotspot_model.npz")
+
+_weights: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = None
+
+
+def export_numpy_weights(state_dict, path: Path = WEIGHTS_PATH) -> None:
+    """Write a HotspotNet state dict as NumPy arrays for the torch-free path."""
+    np.savez(path, **{name: tensor.detach().cpu().numpy() for name, tensor in state_dict.items()})
+
+
+def _load_weights():
+    global _weights
+    if _weights is None:
+        if not WEIGHTS_PATH.exists():
+            # Only hit when the export is missing; torch is needed once to create it
+            import torch
+
+            export_numpy_weights(torch.load(MODEL_PATH, map_location="cpu"))
+        with np.load(WEIGHTS_PATH) as data:
+            _weights = (
+                data["layers.0.weight"].astype(np.float32),
+                data["layers.0.bias"].astype(np.float32),
+                data["layers.2.weight"].astype(np.float32),
+                data["layers.2.bias"].astype(np.float32),
+            )
+    return _weights
 
-model = HotspotNet()
-# Load weights with CPU map to avoid CUDA dependency in local envs
-state = torch.load(Path(__file__).with_name("hotspot_model.pt"), map_location="cpu")
-model.load_state_dict(state)
-model.eval()
 
 def predict(features: list[float]) -> float:
-    with no_grad():
-        return model(tensor(features).unsqueeze(0)).item() 
\ No newline at end of file
+    """Score one feature vector with the 4→16→1 HotspotNet forward pass."""
+    w1, b1, w2, b2 = _load_weights()
+    hidden = np.maximum(w1 @ np.asarray(features, dtype=np.float32) + b1, np.float32(0))
+    logit = (w2 @ hidden + b2)[0]
+    # Numerically stable sigmoid in float32, matching torch.nn.Sigmoid
+    if logit >= 0:
+        return float(np.float32(1) / (np.float32(1) + np.exp(-logit)))
+    z = np.exp(logit)
+    return float(z / (np.float32(1) + z))
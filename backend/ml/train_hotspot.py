@@ -3,16 +3,18 @@ import torch.nn as nn
 import torch.optim as optim
 from torch.utils.data import Dataset, DataLoader
 import numpy as np
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import roc_auc_score
 from sqlalchemy.orm import Session
+from pathlib import Path
 import sys
 import os
 import argparse
 
 # Add parent directory to path to import models
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from metrics import phase
 from models import SessionLocal, Snapshot
+from profiling import profile_run, record_phases
+from ml.real_hotspot import export_numpy_weights
 
 
 class HotspotDataset(Dataset):
@@ -77,6 +79,10 @@ def load_data(db_url="sqlite:///timewarp.db"):
 
 def train_model(X, y, model_path="backend/ml/hotspot_model.pt"):
     """Train the hotspot model."""
+    # Imported here so HotspotNet stays importable without scikit-learn
+    from sklearn.model_selection import train_test_split
+    from sklearn.metrics import roc_auc_score
+
     # 80/20 split
     X_train, X_test, y_train, y_test = train_test_split(
         X, y, test_size=0.2, random_state=42, stratify=y
@@ -99,29 +105,31 @@ def train_model(X, y, model_path="backend/ml/hotspot_model.pt"):
     
     # Training loop
     model.train()
-    for epoch in range(10):
-        total_loss = 0
-        for batch_X, batch_y in train_loader:
-            optimizer.zero_grad()
-            outputs = model(batch_X).squeeze()
-            loss = criterion(outputs, batch_y)
-            loss.backward()
-            optimizer.step()
-            total_loss += loss.item()
+    with phase("train"):
+        for epoch in range(10):
+            total_loss = 0
+            for batch_X, batch_y in train_loader:
+                optimizer.zero_grad()
+                outputs = model(batch_X).squeeze()
+                loss = criterion(outputs, batch_y)
+                loss.backward()
+                optimizer.step()
+                total_loss += loss.item()
         
-        avg_loss = total_loss / len(train_loader)
-        print(f"Epoch {epoch+1}/10, Loss: {avg_loss:.4f}")
+            avg_loss = total_loss / len(train_loader)
+            print(f"Epoch {epoch+1}/10, Loss: {avg_loss:.4f}")
     
     # Evaluate on test set
-    model.eval()
-    test_predictions = []
-    test_labels = []
+    with phase("evaluate"):
+        model.eval()
+        test_predictions = []
+        test_labels = []
     
-    with torch.no_grad():
-        for batch_X, batch_y in test_loader:
-            outputs = model(batch_X).squeeze()
-            test_predictions.extend(outputs.numpy())
-            test_labels.extend(batch_y.numpy())
+        with torch.no_grad():
+            for batch_X, batch_y in test_loader:
+                outputs = model(batch_X).squeeze()
+                test_predictions.extend(outputs.numpy())
+                test_labels.extend(batch_y.numpy())
     
     # Calculate AUC
     auc = roc_auc_score(test_labels, test_predictions)
@@ -129,6 +137,8 @@ def train_model(X, y, model_path="backend/ml/hotspot_model.pt"):
     
     # Save model
     torch.save(model.state_dict(), model_path)
+    # Keep the NumPy export used by torch-free inference in sync
+    export_numpy_weights(model.state_dict(), Path(model_path).with_suffix(".npz"))
     print(f"Model saved to {model_path}")
     
     return model, auc
@@ -138,19 +148,22 @@ def main():
     """Main training function."""
     parser = argparse.ArgumentParser(description="Train hotspot prediction model")
     parser.add_argument("--db-url", default="sqlite:///timewarp.db", help="Database URL")
+    parser.add_argument("--profile", metavar="DIR", help="Write a cProfile report, per-phase timings and peak memory to DIR")
     args = parser.parse_args()
     
-    print("Loading data from database...")
-    X, y = load_data(args.db_url)
-    
-    if X is None:
-        print("Failed to load data. Exiting.")
-        return
-    
-    print("Training hotspot model...")
-    model, auc = train_model(X, y)
-    
-    print(f"Training complete! Final test AUC: {auc:.4f}")
+    with record_phases(args.db_url), profile_run(args.profile, "train"):
+        print("Loading data from database...")
+        with phase("load_data"):
+            X, y = load_data(args.db_url)
+        
+        if X is None:
+            print("Failed to load data. Exiting.")
+            return
+        
+        print("Training hotspot model...")
+        model, auc = train_model(X, y)
+        
+        print(f"Training complete! Final test AUC: {auc:.4f}")
 
 
 if __name__ == "__main__":
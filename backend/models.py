@@ -1,7 +1,14 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, create_engine, JSON
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Index, LargeBinary, create_engine, JSON, event, inspect, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+from sqlalchemy.schema import CreateTable
 import os
-from typing import Dict, Optional
+import sqlite3
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote
+
+from metrics import instrument_engine
 
 Base = declarative_base()
 
@@ -10,7 +17,7 @@ class Commit(Base):
     __tablename__ = "commits"
 
     id = Column(String, primary_key=True)
-    timestamp = Column(Float, nullable=False)
+    timestamp = Column(Float, nullable=False, index=True)
     author = Column(String, nullable=False)
     message = Column(String, nullable=False)
 
@@ -19,6 +26,8 @@ class Commit(Base):
 
 class File(Base):
     __tablename__ = "files"
+    # Ids key cached /layout positions, so a deleted file's id must never be reused
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id = Column(Integer, primary_key=True)
     path = Column(String, unique=True, nullable=False)
@@ -30,8 +39,8 @@ class Snapshot(Base):
     __tablename__ = "snapshots"
 
     id = Column(Integer, primary_key=True)
-    commit_id = Column(String, ForeignKey("commits.id"), nullable=False)
-    file_id = Column(Integer, ForeignKey("files.id"), nullable=False)
+    commit_id = Column(String, ForeignKey("commits.id"), nullable=False, index=True)
+    file_id = Column(Integer, ForeignKey("files.id"), nullable=False, index=True)
     churn = Column(Integer, default=0)
     hotspot_score = Column(Float, default=0.0)
     label = Column(Integer, nullable=True)
@@ -42,27 +51,301 @@ class Snapshot(Base):
     file = relationship("File", back_populates="snapshots")
 
 
-_session_factory_cache: Dict[str, sessionmaker] = {}
+class FileRemoval(Base):
+    """Id of a file deleted by compact.py, reported by /layout so clients drop it."""
+
+    __tablename__ = "file_removals"
+
+    file_id = Column(Integer, primary_key=True, autoincrement=False)
+
+
+class SnapshotPeriod(Base):
+    """Commit whose snapshots were downsampled, and the commit now standing for its period."""
+
+    __tablename__ = "snapshot_periods"
+
+    commit_id = Column(String, ForeignKey("commits.id"), primary_key=True)
+    representative_id = Column(String, ForeignKey("commits.id"), nullable=False, index=True)
+    period_start = Column(Float, nullable=False)
+
+
+class FileLayout(Base):
+    """Stable 3D position of a file, assigned once when the path first appears."""
+
+    __tablename__ = "file_layouts"
+    # Both lookups during assignment are MAX() over an index
+    __table_args__ = (Index("ix_file_layouts_directory_slot", "directory", "slot"),)
+
+    file_id = Column(Integer, ForeignKey("files.id"), primary_key=True)
+    directory = Column(String, nullable=False)
+    # Cluster (order of first appearance, one per CLUSTER_CAPACITY files of a
+    # directory), and order of the file within its directory
+    directory_index = Column(Integer, nullable=False, index=True)
+    slot = Column(Integer, nullable=False)
+    # Spiral index inside the cluster; never reused, even after compact.py
+    # deletes rows. NULL on rows from before the column, until
+    # layout.ensure_layouts fills it in
+    cluster_slot = Column(Integer)
+    x = Column(Float, nullable=False)
+    y = Column(Float, nullable=False)
+    z = Column(Float, nullable=False)
+
+
+class DiffBlob(Base):
+    """Compressed before/after contents, content-addressed by git blob ids.
+
+    An empty blob id stands for "file absent on that side". Identical
+    changes in different commits share one row.
+    """
+
+    __tablename__ = "diff_blobs"
+
+    blob_before = Column(String, primary_key=True)
+    blob_after = Column(String, primary_key=True)
+    codec = Column(String, nullable=False)
+    before = Column(LargeBinary, nullable=False)
+    after = Column(LargeBinary, nullable=False)
+
+
+class DiffRef(Base):
+    """Which cached diff a (commit, file) pair resolves to."""
+
+    __tablename__ = "diff_refs"
+
+    commit_id = Column(String, ForeignKey("commits.id"), primary_key=True)
+    file_id = Column(Integer, ForeignKey("files.id"), primary_key=True)
+    blob_before = Column(String, nullable=False)
+    blob_after = Column(String, nullable=False)
+
+
+class IngestPhase(Base):
+    """Running totals of ``metrics.phase`` timings from the ingest commands.
+
+    Those commands exit before anything scrapes them, so they add their totals
+    here and the API's ``/metrics`` reports them.
+    """
+
+    __tablename__ = "ingest_phases"
+
+    phase = Column(String, primary_key=True)
+    calls = Column(Integer, nullable=False, default=0)
+    seconds = Column(Float, nullable=False, default=0.0)
+    cpu_seconds = Column(Float, nullable=False, default=0.0)
+
+
+# SQLite storage profile. WAL lets API readers keep reading while an ingest
+# commits; NORMAL sync is durable in WAL mode except across power loss.
+SQLITE_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # negative = KiB, i.e. 64 MiB per connection
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
 
+# Full-text search over commit messages/authors and a trigram index over file
+# paths, kept in sync by triggers so every ingest path maintains them.
+_SQLITE_SEARCH_DDL = {
+    "commits_fts": [
+        "CREATE VIRTUAL TABLE commits_fts USING fts5(message, author, content='commits', content_rowid='rowid')",
+        """CREATE TRIGGER IF NOT EXISTS commits_fts_ai AFTER INSERT ON commits BEGIN
+            INSERT INTO commits_fts(rowid, message, author) VALUES (new.rowid, new.message, new.author);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS commits_fts_ad AFTER DELETE ON commits BEGIN
+            INSERT INTO commits_fts(commits_fts, rowid, message, author)
+            VALUES ('delete', old.rowid, old.message, old.author);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS commits_fts_au AFTER UPDATE ON commits BEGIN
+            INSERT INTO commits_fts(commits_fts, rowid, message, author)
+            VALUES ('delete', old.rowid, old.message, old.author);
+            INSERT INTO commits_fts(rowid, message, author) VALUES (new.rowid, new.message, new.author);
+        END""",
+    ],
+    "files_fts": [
+        "CREATE VIRTUAL TABLE files_fts USING fts5(path, content='files', content_rowid='id', tokenize='trigram')",
+        """CREATE TRIGGER IF NOT EXISTS files_fts_ai AFTER INSERT ON files BEGIN
+            INSERT INTO files_fts(rowid, path) VALUES (new.id, new.path);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS files_fts_ad AFTER DELETE ON files BEGIN
+            INSERT INTO files_fts(files_fts, rowid, path) VALUES ('delete', old.id, old.path);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS files_fts_au AFTER UPDATE ON files BEGIN
+            INSERT INTO files_fts(files_fts, rowid, path) VALUES ('delete', old.id, old.path);
+            INSERT INTO files_fts(rowid, path) VALUES (new.id, new.path);
+        END""",
+    ],
+}
 
-def _get_or_create_session_factory(db_url: str) -> sessionmaker:
-    global _session_factory_cache
-    if db_url not in _session_factory_cache:
+
+def _migrate_files_autoincrement(engine: Engine) -> None:
+    """Rebuild a pre-AUTOINCREMENT ``files`` table so freed ids are never handed out again.
+
+    Follows SQLite's create/copy/drop/rename procedure, which leaves the
+    other tables' references to ``files`` intact. The search triggers go
+    with the old table and are recreated by ``_ensure_schema``.
+    """
+    with engine.begin() as conn:
+        row = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'files'")).first()
+        if row is None or "AUTOINCREMENT" in row[0].upper():
+            return
+        ddl = str(CreateTable(File.__table__).compile(engine))
+        conn.execute(text(ddl.replace("CREATE TABLE files", "CREATE TABLE files_new", 1)))
+        conn.execute(text("INSERT INTO files_new (id, path) SELECT id, path FROM files"))
+        conn.execute(text("DROP TABLE files"))
+        conn.execute(text("ALTER TABLE files_new RENAME TO files"))
+
+        # Layout rows may outlive a file deleted before this migration; never reissue those ids
+        high = [conn.execute(text("SELECT MAX(id) FROM files")).scalar()]
+        if conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'file_layouts'")).first():
+            high.append(conn.execute(text("SELECT MAX(file_id) FROM file_layouts")).scalar())
+        high = [h for h in high if h is not None]
+        if high:
+            conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'files'"))
+            conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('files', :seq)"), {"seq": max(high)})
+
+
+def _add_missing_columns(engine: Engine) -> None:
+    """Add nullable columns introduced after a table was created."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+
+def _ensure_schema(engine: Engine) -> None:
+    if engine.dialect.name == "sqlite":
+        _migrate_files_autoincrement(engine)
+    _add_missing_columns(engine)
+    Base.metadata.create_all(engine)
+    # create_all skips indexes on tables that already exist
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as conn:
+        for table, statements in _SQLITE_SEARCH_DDL.items():
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table}
+            ).first()
+            if exists:
+                # Triggers are dropped with their table (see _migrate_files_autoincrement)
+                for statement in statements[1:]:
+                    conn.execute(text(statement))
+                continue
+            try:
+                for statement in statements:
+                    conn.execute(text(statement))
+            except OperationalError:
+                # SQLite built without FTS5 (or trigram, < 3.34): search falls back to LIKE
+                continue
+            # Index rows ingested before the search table existed
+            conn.execute(text(f"INSERT INTO {table}({table}) VALUES ('rebuild')"))
+
+
+_engine_cache: Dict[Tuple[str, bool], Engine] = {}
+_session_factory_cache: Dict[Tuple[str, bool], sessionmaker] = {}
+
+
+def _default_db_url() -> str:
+    return os.getenv("DATABASE_URL", "sqlite:///timewarp.db")
+
+
+def _sqlite_file_path(db_url: str) -> Optional[str]:
+    """Return the database file for on-disk SQLite URLs, else None."""
+    url = make_url(db_url)
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        return None
+    return url.database
+
+
+def _set_sqlite_pragmas(dbapi_connection, read_only: bool) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        if not read_only:
+            # Takes effect on new files (or at the next full VACUUM) and lets
+            # compact.py hand free pages back in small steps
+            cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # Persistent on the database file; readers inherit it
+            cursor.execute("PRAGMA journal_mode=WAL")
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def _create_engine(db_url: str, read_only: bool) -> Engine:
+    path = _sqlite_file_path(db_url)
+    if path is None:
+        return create_engine(db_url)
+
+    if read_only:
+        uri = "file:" + quote(os.path.abspath(path)) + "?mode=ro"
+        engine = create_engine(
+            db_url,
+            creator=lambda: sqlite3.connect(uri, uri=True, check_same_thread=False),
+        )
+    else:
         engine = create_engine(db_url)
-        # Ensure tables exist once per engine
-        Base.metadata.create_all(engine)
-        _session_factory_cache[db_url] = sessionmaker(bind=engine)
-    return _session_factory_cache[db_url]
+    event.listen(engine, "connect", lambda conn, _: _set_sqlite_pragmas(conn, read_only))
+    return engine
+
 
+def get_engine(db_url: Optional[str] = None, read_only: bool = False) -> Engine:
+    """Return the shared, pooled engine for ``db_url``.
 
-def get_engine(db_url: Optional[str] = None):
+    ``read_only=True`` opens SQLite files with ``mode=ro`` connections, used by
+    the API so it can never take the write lock an ingest needs. The schema is
+    created through the read-write engine first.
+    """
     if not db_url:
-        db_url = os.getenv("DATABASE_URL", "sqlite:///timewarp.db")
-    return create_engine(db_url)
+        db_url = _default_db_url()
+    if _sqlite_file_path(db_url) is None:
+        read_only = False
+    key = (db_url, read_only)
+    if key not in _engine_cache:
+        if read_only:
+            get_engine(db_url)
+        engine = _create_engine(db_url, read_only)
+        instrument_engine(engine)
+        if not read_only:
+            # Ensure tables, indexes and search tables exist once per engine
+            _ensure_schema(engine)
+        _engine_cache[key] = engine
+    return _engine_cache[key]
+
+
+def reset_engine(db_url: Optional[str] = None) -> None:
+    """Dispose the cached engines and session factories for ``db_url``.
+
+    The next ``get_engine`` opens new connections and re-runs the schema
+    checks, e.g. after the file was replaced or changed outside SQLAlchemy.
+    """
+    if not db_url:
+        db_url = _default_db_url()
+    for read_only in (False, True):
+        _session_factory_cache.pop((db_url, read_only), None)
+        engine = _engine_cache.pop((db_url, read_only), None)
+        if engine is not None:
+            engine.dispose()
+
+
+def _get_or_create_session_factory(db_url: str, read_only: bool = False) -> sessionmaker:
+    key = (db_url, read_only)
+    if key not in _session_factory_cache:
+        _session_factory_cache[key] = sessionmaker(bind=get_engine(db_url, read_only))
+    return _session_factory_cache[key]
 
 
-def SessionLocal(db_url: Optional[str] = None):
+def SessionLocal(db_url: Optional[str] = None, read_only: bool = False):
     if not db_url:
-        db_url = os.getenv("DATABASE_URL", "sqlite:///timewarp.db")
-    factory = _get_or_create_session_factory(db_url)
+        db_url = _default_db_url()
+    factory = _get_or_create_session_factory(db_url, read_only)
     return factory()
@@ -0,0 +1,130 @@
+"""Profiling helpers for the ingest/training entry points and the API.
+
+``profile_run`` wraps a whole command: it records a cProfile report, a
+per-phase wall/CPU table built from ``metrics.phase`` timings, and peak memory
+from tracemalloc, writing everything to a chosen directory. ``record_phases``
+adds a command's phase timings to the database for the API's ``/metrics``.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Optional, Tuple
+
+from metrics import phase_totals
+from models import IngestPhase, SessionLocal
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def write_stats(profiler: cProfile.Profile, base_path: str, limit: int = 50) -> None:
+    profiler.dump_stats(base_path + ".prof")
+    buffer = io.StringIO()
+    stats = pstats.Stats(profiler, stream=buffer)
+    stats.sort_stats("cumulative").print_stats(limit)
+    with open(base_path + ".txt", "w") as f:
+        f.write(buffer.getvalue())
+
+
+def _phase_table(
+    before: Dict[str, Tuple[int, float, float]],
+    after: Dict[str, Tuple[int, float, float]],
+    total_wall: float,
+) -> str:
+    rows = []
+    for name, (calls, wall, cpu) in after.items():
+        prev_calls, prev_wall, prev_cpu = before.get(name, (0, 0.0, 0.0))
+        if calls - prev_calls:
+            rows.append((name, calls - prev_calls, wall - prev_wall, cpu - prev_cpu))
+    rows.sort(key=lambda row: row[2], reverse=True)
+
+    lines = [f"{'phase':<24}{'calls':>10}{'wall s':>12}{'cpu s':>12}{'% wall':>9}"]
+    for name, calls, wall, cpu in rows:
+        share = 100.0 * wall / total_wall if total_wall else 0.0
+        lines.append(f"{name:<24}{calls:>10}{wall:>12.3f}{cpu:>12.3f}{share:>8.1f}%")
+    accounted = sum(row[2] for row in rows)
+    lines.append(f"{'(unaccounted)':<24}{'':>10}{total_wall - accounted:>12.3f}{'':>12}{'':>9}")
+    return "\n".join(lines)
+
+
+@contextmanager
+def _profile(output_dir: str, name: str):
+    os.makedirs(output_dir, exist_ok=True)
+    base_path = os.path.join(output_dir, name)
+
+    phases_before = phase_totals()
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        total_wall = time.perf_counter() - wall_start
+        total_cpu = time.process_time() - cpu_start
+        _, peak_traced = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        write_stats(profiler, base_path)
+        lines = [
+            f"command: {name}",
+            f"wall time: {total_wall:.3f} s",
+            f"cpu time: {total_cpu:.3f} s",
+            f"peak traced memory: {peak_traced / (1024 * 1024):.1f} MiB",
+        ]
+        if resource is not None:
+            # ru_maxrss is KiB on Linux
+            max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            lines.append(f"max RSS: {max_rss_mb:.1f} MiB")
+        summary = "\n".join(
+            lines
+            + [
+                "",
+                _phase_table(phases_before, phase_totals(), total_wall),
+                "",
+            ]
+        )
+        with open(base_path + "-phases.txt", "w") as f:
+            f.write(summary)
+        print(f"Profile written to {base_path}.prof, {base_path}.txt, {base_path}-phases.txt")
+
+
+def profile_run(output_dir: Optional[str], name: str):
+    """Profile the enclosed block into ``output_dir``; no-op when it is None."""
+    if not output_dir:
+        return nullcontext()
+    return _profile(output_dir, name)
+
+
+@contextmanager
+def record_phases(db_url: Optional[str]):
+    """Add the phase timings of the enclosed block to ``ingest_phases`` in ``db_url``."""
+    before = phase_totals()
+    try:
+        yield
+    finally:
+        session = SessionLocal(db_url)
+        try:
+            for name, (calls, wall, cpu) in phase_totals().items():
+                prev_calls, prev_wall, prev_cpu = before.get(name, (0, 0.0, 0.0))
+                if calls == prev_calls:
+                    continue
+                row = session.get(IngestPhase, name)
+                if row is None:
+                    row = IngestPhase(phase=name, calls=0, seconds=0.0, cpu_seconds=0.0)
+                    session.add(row)
+                row.calls += calls - prev_calls
+                row.seconds += wall - prev_wall
+                row.cpu_seconds += cpu - prev_cpu
+            session.commit()
+        finally:
+            session.close()
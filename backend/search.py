@@ -0,0 +1,165 @@
+"""Commit and path search backed by SQLite FTS5.
+
+Commit messages/authors are matched through ``commits_fts`` and paths through
+the trigram-tokenized ``files_fts`` (both maintained by triggers, see
+``models._SQLITE_SEARCH_DDL``). Databases without those tables fall back to
+``LIKE`` scans. Every hit carries its position on the timeline so clients can
+jump straight to the right ``/timeline`` page.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+_search_tables: Dict[Tuple[str, str], bool] = {}
+
+
+def _has_table(session: Session, table: str) -> bool:
+    bind = session.get_bind()
+    key = (str(bind.url), table)
+    if key not in _search_tables:
+        _search_tables[key] = bind.dialect.name == "sqlite" and (
+            session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table}
+            ).first()
+            is not None
+        )
+    return _search_tables[key]
+
+
+def _fts_query(q: str, prefix: bool) -> str:
+    """Quote each term so user input can't inject FTS5 syntax."""
+    terms = ['"' + term.replace('"', '""') + '"' + ("*" if prefix else "") for term in q.split()]
+    return " ".join(terms)
+
+
+def _like_pattern(q: str) -> str:
+    escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def timeline_positions(session: Session, timestamps: List[float]) -> Dict[float, int]:
+    """Map each timestamp to the number of commits strictly before it.
+
+    Walks the timestamp index once, counting between consecutive requested
+    timestamps, instead of one full count per hit.
+    """
+    positions: Dict[float, int] = {}
+    count = 0
+    previous: Optional[float] = None
+    for ts in sorted(set(timestamps)):
+        if previous is None:
+            count = session.execute(
+                text("SELECT COUNT(*) FROM commits WHERE timestamp < :ts"), {"ts": ts}
+            ).scalar()
+        else:
+            count += session.execute(
+                text("SELECT COUNT(*) FROM commits WHERE timestamp >= :lo AND timestamp < :hi"),
+                {"lo": previous, "hi": ts},
+            ).scalar()
+        positions[ts] = count
+        previous = ts
+    return positions
+
+
+def search_commits(session: Session, q: str, limit: int = 20) -> List[dict]:
+    if _has_table(session, "commits_fts"):
+        # The LIMIT keeps the most recently ingested matches: FTS5 walks rowids
+        # in order and stops early, where ORDER BY rank or timestamp would visit
+        # every match. Ingest streams history oldest-first, so these are
+        # normally also the newest commits; the page itself is sorted by time.
+        rows = session.execute(
+            text(
+                "SELECT id, timestamp, author, message FROM ("
+                "SELECT c.id, c.timestamp, c.author, c.message FROM commits_fts "
+                "JOIN commits c ON c.rowid = commits_fts.rowid "
+                "WHERE commits_fts MATCH :q ORDER BY commits_fts.rowid DESC LIMIT :limit"
+                ") AS hits ORDER BY timestamp DESC, id"
+            ),
+            {"q": _fts_query(q, prefix=True), "limit": limit},
+        ).all()
+    else:
+        rows = session.execute(
+            text(
+                "SELECT id, timestamp, author, message FROM commits "
+                "WHERE message LIKE :q ESCAPE '\\' OR author LIKE :q ESCAPE '\\' "
+                "ORDER BY timestamp DESC LIMIT :limit"
+            ),
+            {"q": _like_pattern(q), "limit": limit},
+        ).all()
+    return [
+        {"id": row[0], "timestamp": row[1], "author": row[2], "message": row[3].strip()} for row in rows
+    ]
+
+
+def search_files(session: Session, q: str, limit: int = 20) -> List[dict]:
+    if len(q) >= 3 and _has_table(session, "files_fts"):
+        # Trigram index: substring match anywhere in the path
+        rows = session.execute(
+            text(
+                "SELECT f.id, f.path FROM files_fts JOIN files f ON f.id = files_fts.rowid "
+                "WHERE files_fts MATCH :q ORDER BY files_fts.rowid LIMIT :limit"
+            ),
+            {"q": _fts_query(q, prefix=False), "limit": limit},
+        ).all()
+    elif len(q) < 3:
+        # Too short for trigrams: prefix range scan on the unique path index
+        upper = q[:-1] + chr(ord(q[-1]) + 1)
+        rows = session.execute(
+            text("SELECT id, path FROM files WHERE path >= :lo AND path < :hi ORDER BY path LIMIT :limit"),
+            {"lo": q, "hi": upper, "limit": limit},
+        ).all()
+    else:
+        rows = session.execute(
+            text("SELECT id, path FROM files WHERE path LIKE :q ESCAPE '\\' ORDER BY path LIMIT :limit"),
+            {"q": _like_pattern(q), "limit": limit},
+        ).all()
+    if not rows:
+        return []
+
+    # Most recent commit touching each file, via the snapshots.file_id index
+    ids = [row[0] for row in rows]
+    params = {f"id{i}": file_id for i, file_id in enumerate(ids)}
+    placeholders = ", ".join(f":id{i}" for i in range(len(ids)))
+    latest = {
+        file_id: (commit_id, ts)
+        for file_id, ts, commit_id in session.execute(
+            text(
+                "SELECT file_id, timestamp, commit_id FROM ("
+                "SELECT s.file_id, c.timestamp, c.id AS commit_id, ROW_NUMBER() OVER ("
+                "PARTITION BY s.file_id ORDER BY c.timestamp DESC, c.id DESC) AS n "
+                "FROM snapshots s JOIN commits c ON c.id = s.commit_id "
+                f"WHERE s.file_id IN ({placeholders})"
+                ") AS ranked WHERE n = 1"
+            ),
+            params,
+        ).all()
+    }
+    return [
+        {
+            "file_id": file_id,
+            "path": path,
+            "commit_id": latest.get(file_id, (None, None))[0],
+            "timestamp": latest.get(file_id, (None, None))[1],
+        }
+        for file_id, path in rows
+    ]
+
+
+def search(session: Session, q: str, limit: int = 20, page_size: int = 200) -> dict:
+    """Search commits and files, annotating hits with timeline position/page."""
+    q = q.strip()
+    if not q:
+        return {"commits": [], "files": []}
+    commits = search_commits(session, q, limit)
+    files = search_files(session, q, limit)
+
+    positions = timeline_positions(
+        session, [c["timestamp"] for c in commits] + [f["timestamp"] for f in files if f["timestamp"] is not None]
+    )
+    for hit in commits + files:
+        position = positions.get(hit["timestamp"])
+        hit["position"] = position
+        hit["page"] = None if position is None else position // page_size + 1
+    return {"commits": commits, "files": files}
@@ -1,5 +1,65 @@
+import argparse
+import hashlib
+import os
+import shutil
+import tempfile
+
 import uvicorn
-from api.app import app
+
+
+def _default_cache_dir() -> str:
+    # One directory per database so two servers on one host don't mix entries
+    db_url = os.getenv("DATABASE_URL", "sqlite:///timewarp.db")
+    if db_url.startswith("sqlite:///") and not db_url.startswith("sqlite:////"):
+        db_url = "sqlite:///" + os.path.abspath(db_url[len("sqlite:///"):])
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    # SharedCache creates it 0700 and refuses it if another user got there first
+    name = f"timewarp-{os.getuid()}-" if hasattr(os, "getuid") else "timewarp-"
+    return os.path.join(base, name + hashlib.sha1(db_url.encode("utf-8")).hexdigest()[:12])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the TimeWarp API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes sharing the read-only database")
+    parser.add_argument("--cache-dir", help="Shared payload cache directory (default: under /dev/shm)")
+    parser.add_argument("--cache-mb", type=int, default=256, help="Shared cache size limit in MiB")
+    parser.add_argument(
+        "--no-shared-cache",
+        action="store_true",
+        help="Disable the cross-worker cache (only with one worker; /metrics merges workers through it)",
+    )
+    parser.add_argument("--warm", type=int, default=50, help="Cache snapshots of the N most recent commits at startup")
+    args = parser.parse_args()
+    if args.no_shared_cache and args.workers > 1:
+        # Each worker would answer /metrics with only its own requests
+        parser.error("--no-shared-cache needs --workers 1")
+
+    if not args.no_shared_cache:
+        # Workers inherit the environment, so they all open the same cache
+        os.environ["TIMEWARP_SHARED_CACHE_DIR"] = args.cache_dir or _default_cache_dir()
+        os.environ["TIMEWARP_SHARED_CACHE_MB"] = str(args.cache_mb)
+
+    from api.app import shared_cache, warm_snapshot_cache
+
+    if shared_cache is not None:
+        # Metrics exported by a previous server's workers; counters restart with the server
+        shutil.rmtree(os.path.join(shared_cache.directory, "metrics"), ignore_errors=True)
+
+    # Warm once here rather than in every worker
+    warmed = warm_snapshot_cache(args.warm)
+    if warmed:
+        print(f"Warmed snapshot cache with {warmed} commits")
+
+    uvicorn.run(
+        "api.app:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+    )
+
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    main()
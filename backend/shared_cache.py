@@ -0,0 +1,121 @@
+"""Cross-process cache for hot API payloads and blob contents.
+
+Entries are files in one directory; ``server.py`` puts it under ``/dev/shm``,
+so on Linux they live in shared memory. Every uvicorn worker sees the same entries
+without copying them into each process heap. Writes go to a temp file
+followed by an atomic rename, so readers never see a partial entry, and no
+locks are needed. When the directory grows past ``max_bytes`` the least
+recently written entries are evicted.
+
+Keys are predictable, so whoever controls the directory controls what the
+API serves. It is created private to the current user, and an existing
+directory is refused unless it is a real directory owned by this user with
+no group or other access.
+"""
+
+import hashlib
+import os
+import stat
+import tempfile
+from typing import Optional
+
+from metrics import record_cache
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+_EVICT_EVERY = 64
+
+
+def _check_private(directory: str) -> None:
+    """Refuse a cache directory another local user could write into."""
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode):
+        raise PermissionError(f"shared cache {directory!r} is not a directory (symlink?)")
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        raise PermissionError(f"shared cache {directory!r} is owned by uid {st.st_uid}, not {os.getuid()}")
+    if st.st_mode & 0o077:
+        raise PermissionError(
+            f"shared cache {directory!r} has mode {stat.S_IMODE(st.st_mode):o}; it must not be group/other accessible"
+        )
+
+
+class SharedCache:
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._writes = 0
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        _check_private(directory)
+
+    @classmethod
+    def from_env(cls) -> Optional["SharedCache"]:
+        """Cache configured by ``TIMEWARP_SHARED_CACHE_DIR``; None when unset."""
+        directory = os.getenv("TIMEWARP_SHARED_CACHE_DIR")
+        if not directory:
+            return None
+        max_mb = os.getenv("TIMEWARP_SHARED_CACHE_MB")
+        return cls(directory, int(max_mb) * 1024 * 1024 if max_mb else DEFAULT_MAX_BYTES)
+
+    def subdirectory(self, name: str) -> str:
+        """A private directory inside the cache that eviction leaves alone."""
+        path = os.path.join(self.directory, name)
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        _check_private(path)
+        return path
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(f"{namespace}:{key}"), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            record_cache(namespace, False)
+            return None
+        record_cache(namespace, True)
+        return data
+
+    def set(self, namespace: str, key: str, data: bytes) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(f"{namespace}:{key}"))
+        except OSError:
+            # A full tmpfs just means this entry isn't cached
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return
+        self._writes += 1
+        if self._writes % _EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self) -> int:
+        """Trim to 90% of ``max_bytes``, oldest entries first; returns bytes freed."""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith(".tmp-") or not entry.is_file(follow_symlinks=False):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return 0
+        freed = 0
+        target = total - int(self.max_bytes * 0.9)
+        for _, size, path in sorted(entries):
+            if freed >= target:
+                break
+            try:
+                os.unlink(path)
+                freed += size
+            except FileNotFoundError:
+                pass
+        return freed
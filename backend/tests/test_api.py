@@ -3,6 +3,7 @@ import tempfile
 import subprocess
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import text
 
 from api.app import app
 from models import SessionLocal, Commit, File, Snapshot
@@ -79,3 +80,521 @@ def test_timeline_and_snapshot_and_diff(temp_repo_and_db):
     diff = r3.json()
     assert "hello" in diff["after"]
 
+
+def test_metrics_reports_route_latency_sql_and_git_reads(temp_repo_and_db):
+    client = TestClient(app)
+    last_commit = temp_repo_and_db["commits"][-1]
+    client.get(f"/snapshot/{last_commit}")
+    client.get(f"/diff/{last_commit}/a.txt")
+
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    body = r.text
+    assert 'timewarp_http_request_duration_seconds_count{method="GET",route="/snapshot/{commit_id}"}' in body
+    assert 'timewarp_http_request_db_queries_bucket{route="/snapshot/{commit_id}",le="+Inf"}' in body
+    assert 'timewarp_git_objects_read_total{endpoint="diff"}' in body
+    assert "timewarp_db_queries_total" in body
+
+
+def test_metrics_reports_ingest_phases_persisted_by_commands(temp_repo_and_db):
+    """Ingest commands run in their own process; /metrics reads their totals from the database."""
+    import metrics
+    from profiling import record_phases
+
+    client = TestClient(app)
+    assert "timewarp_ingest_phase_calls_total{" not in client.get("/metrics").text
+
+    for _ in range(2):
+        with record_phases(temp_repo_and_db["db_url"]):
+            with metrics.phase("db_writes"):
+                pass
+
+    body = client.get("/metrics").text
+    assert 'timewarp_ingest_phase_calls_total{phase="db_writes"} 2' in body
+    assert 'timewarp_ingest_phase_seconds_total{phase="db_writes"}' in body
+    assert 'timewarp_ingest_phase_cpu_seconds_total{phase="db_writes"}' in body
+
+
+def test_metrics_sum_over_workers_sharing_the_cache(temp_repo_and_db, tmp_path, monkeypatch):
+    import api.app as api_app
+    import metrics
+    from shared_cache import SharedCache
+
+    cache = SharedCache(str(tmp_path / "shm"), max_bytes=1)
+    monkeypatch.setattr(api_app, "shared_cache", cache)
+    client = TestClient(app)
+    client.get("/timeline")
+
+    # Another worker that has served exactly what this one has
+    workers_dir = cache.subdirectory("metrics")
+    metrics.export(workers_dir)
+    os.replace(os.path.join(workers_dir, f"metrics-{os.getpid()}.json"), os.path.join(workers_dir, "metrics-1.json"))
+    requests = int(metrics.http_requests.get(method="GET", route="/timeline", status="200"))
+    observed = metrics.http_request_duration.count(method="GET", route="/timeline")
+
+    body = client.get("/metrics").text
+    assert f'timewarp_http_requests_total{{method="GET",route="/timeline",status="200"}} {2 * requests}' in body
+    assert f'timewarp_http_request_duration_seconds_count{{method="GET",route="/timeline"}} {2 * observed}' in body
+
+    # Cache eviction never touches the worker files
+    cache.set("snapshot", "k", b"x" * 10)
+    cache.evict()
+    assert os.listdir(workers_dir) == ["metrics-1.json"]
+
+
+def test_snapshot_reads_while_ingest_holds_write_lock(temp_repo_and_db):
+    """WAL + read-only API connections: readers never wait on the writer."""
+    import threading
+    from sqlalchemy import text
+    from models import SQLITE_PRAGMAS
+
+    client = TestClient(app)
+    first_commit, last_commit = temp_repo_and_db["commits"][0], temp_repo_and_db["commits"][-1]
+    assert client.get(f"/snapshot/{last_commit}").status_code == 200
+
+    flushed = threading.Event()
+    release = threading.Event()
+
+    def large_ingest():
+        session = SessionLocal(temp_repo_and_db["db_url"])
+        try:
+            # Tiny page cache so the transaction spills to disk mid-write, as an
+            # ingest larger than the cache would; without WAL that takes an
+            # exclusive lock that blocks every reader
+            session.execute(text("PRAGMA cache_size=16"))
+            files = [File(path=f"gen/{i}.txt") for i in range(20000)]
+            session.add_all(files)
+            session.flush()
+            session.bulk_save_objects(
+                [Snapshot(commit_id=first_commit, file_id=f.id, churn=i % 7, hotspot_score=0.5) for i, f in enumerate(files)]
+            )
+            session.flush()
+            flushed.set()
+            # Keep the write transaction open until the reads below are done
+            release.wait(timeout=30)
+            session.commit()
+            session.execute(text(f"PRAGMA cache_size={SQLITE_PRAGMAS['cache_size']}"))
+        finally:
+            flushed.set()
+            session.close()
+
+    writer = threading.Thread(target=large_ingest)
+    writer.start()
+    try:
+        assert flushed.wait(timeout=30)
+        # Reads succeed under the held write lock and see the pre-commit state
+        r = client.get(f"/snapshot/{last_commit}")
+        assert r.status_code == 200
+        assert [s["path"] for s in r.json()] == ["a.txt"]
+        assert client.get(f"/snapshot/{first_commit}").status_code == 404
+    finally:
+        release.set()
+        writer.join()
+
+    # Once committed, the new rows are visible to the read-only API sessions
+    assert len(client.get(f"/snapshot/{first_commit}").json()) == 20000
+
+
+def test_layout_is_stable_and_incremental(temp_repo_and_db):
+    from layout import assign_layout, ensure_layouts
+
+    session = SessionLocal(temp_repo_and_db["db_url"])
+    try:
+        assert ensure_layouts(session) == 1
+    finally:
+        session.close()
+
+    client = TestClient(app)
+    last_commit = temp_repo_and_db["commits"][-1]
+    snapshot = client.get(f"/snapshot/{last_commit}").json()
+    file_id = str(snapshot[0]["file_id"])
+
+    layout = client.get("/layout").json()
+    assert layout["files"][file_id]["path"] == "a.txt"
+    before = layout["files"][file_id]
+
+    # New paths get new positions without moving existing ones
+    session = SessionLocal(temp_repo_and_db["db_url"])
+    try:
+        for path in ["src/b.py", "src/c.py", "docs/d.md"]:
+            new_file = File(path=path)
+            session.add(new_file)
+            session.flush()
+            assign_layout(session, new_file)
+        session.commit()
+    finally:
+        session.close()
+
+    update = client.get("/layout", params={"since_id": layout["version"]}).json()
+    assert sorted(f["path"] for f in update["files"].values()) == ["docs/d.md", "src/b.py", "src/c.py"]
+    assert client.get("/layout").json()["files"][file_id] == before
+    positions = {(f["x"], f["y"], f["z"]) for f in client.get("/layout").json()["files"].values()}
+    assert len(positions) == 4
+
+
+def test_layout_clusters_stay_bounded_for_large_directories(temp_repo_and_db):
+    import math
+
+    from layout import CLUSTER_CAPACITY, CLUSTER_RADIUS, DIRECTORY_SPACING, _spiral_point, assign_layout
+    from models import FileLayout
+
+    session = SessionLocal(temp_repo_and_db["db_url"])
+    try:
+        paths = [f"big/m{i}.py" for i in range(3 * CLUSTER_CAPACITY)] + [f"small/s{i}.py" for i in range(5)]
+        for path in paths:
+            new_file = File(path=path)
+            session.add(new_file)
+            session.flush()
+            assign_layout(session, new_file)
+        session.commit()
+        layouts = session.query(FileLayout).all()
+    finally:
+        session.close()
+
+    clusters = {}
+    for layout in layouts:
+        clusters.setdefault(layout.directory_index, set()).add(layout.directory)
+        cx, cy = _spiral_point(layout.directory_index, DIRECTORY_SPACING)
+        assert math.hypot(layout.x - cx, layout.y - cy) <= CLUSTER_RADIUS + 1e-9
+    # One directory per cluster; the large one continues in further clusters
+    assert all(len(directories) == 1 for directories in clusters.values())
+    assert sum(directories == {"big"} for directories in clusters.values()) == 3
+    assert sorted(layout.slot for layout in layouts if layout.directory == "big") == list(range(3 * CLUSTER_CAPACITY))
+
+
+def test_layout_never_reuses_positions_freed_by_compaction(temp_repo_and_db):
+    from compact import compact
+    from layout import assign_layout, backfill_cluster_slots
+    from models import FileLayout
+
+    db_url = temp_repo_and_db["db_url"]
+    last_commit = temp_repo_and_db["commits"][-1]
+    session = SessionLocal(db_url)
+    try:
+        for i in range(5):
+            new_file = File(path=f"src/f{i}.py")
+            session.add(new_file)
+            session.flush()
+            assign_layout(session, new_file)
+            # src/f1.py is never in a snapshot, so compaction deletes it
+            if i != 1:
+                session.add(Snapshot(commit_id=last_commit, file_id=new_file.id, churn=1, hotspot_score=0.1))
+        session.commit()
+    finally:
+        session.close()
+
+    assert compact(db_url)["orphans"]["file_layouts"] == 1
+
+    session = SessionLocal(db_url)
+    try:
+        new_file = File(path="src/new.py")
+        session.add(new_file)
+        session.flush()
+        assign_layout(session, new_file)
+        session.commit()
+        layouts = session.query(FileLayout).filter(FileLayout.directory == "src").all()
+        assert len({(l.x, l.y, l.z) for l in layouts}) == len(layouts) == 5
+
+        # Rows from before the column get their spiral index back from their coordinates
+        expected = {l.file_id: l.cluster_slot for l in layouts}
+        session.query(FileLayout).update({FileLayout.cluster_slot: None})
+        assert backfill_cluster_slots(session) == 5
+        session.commit()
+        assert {l.file_id: l.cluster_slot for l in layouts} == expected
+    finally:
+        session.close()
+
+
+def test_search_commits_and_paths_with_timeline_positions(temp_repo_and_db):
+    session = SessionLocal(temp_repo_and_db["db_url"])
+    try:
+        session.add(Commit(id="c" * 40, timestamp=5.0, author="Ada Lovelace", message="Speed up parser cache\n"))
+        session.add(Commit(id="d" * 40, timestamp=6.0, author="t", message="docs: mention 100% coverage"))
+        session.add(File(path="backend/parser/cache.py"))
+        session.commit()
+    finally:
+        session.close()
+
+    client = TestClient(app)
+    r = client.get("/search", params={"q": "pars", "page_size": 2})
+    assert r.status_code == 200
+    body = r.json()
+    assert [c["id"] for c in body["commits"]] == ["c" * 40]
+    # Two seeded commits at t=1.0 come first on the timeline
+    assert body["commits"][0]["position"] == 2
+    assert body["commits"][0]["page"] == 2
+    assert [f["path"] for f in body["files"]] == ["backend/parser/cache.py"]
+    assert body["files"][0]["position"] is None
+
+    assert [c["id"] for c in client.get("/search", params={"q": "lovelace"}).json()["commits"]] == ["c" * 40]
+    # FTS syntax characters are treated as plain text
+    assert client.get("/search", params={"q": '100% "cov'}).status_code == 200
+    files = client.get("/search", params={"q": "a."}).json()["files"]
+    assert [f["path"] for f in files] == ["a.txt"]
+    assert files[0]["commit_id"] == temp_repo_and_db["commits"][-1]
+
+    # Back-filled history: ingested last, but older, so it sorts after newer hits
+    session = SessionLocal(temp_repo_and_db["db_url"])
+    try:
+        session.add(Commit(id="e" * 40, timestamp=0.5, author="t", message="parser: initial import"))
+        cache_py = session.query(File).filter(File.path == "backend/parser/cache.py").one()
+        session.add(Snapshot(commit_id="c" * 40, file_id=cache_py.id, churn=1, hotspot_score=0.1))
+        session.add(Snapshot(commit_id="e" * 40, file_id=cache_py.id, churn=1, hotspot_score=0.1))
+        session.commit()
+    finally:
+        session.close()
+    body = client.get("/search", params={"q": "pars"}).json()
+    assert [c["id"] for c in body["commits"]] == ["c" * 40, "e" * 40]
+    assert body["files"][0]["commit_id"] == "c" * 40
+
+
+def test_diff_served_from_precomputed_cache(temp_repo_and_db, tmp_path):
+    import diff_cache
+    from git import Repo
+
+    session = SessionLocal(temp_repo_and_db["db_url"])
+    try:
+        commits, written = diff_cache.warm(session, Repo(temp_repo_and_db["repo"]), threshold=0.05)
+    finally:
+        session.close()
+    assert (commits, written) == (1, 1)
+
+    # With no repository reachable, only the cache can answer
+    not_a_repo = tmp_path / "elsewhere"
+    not_a_repo.mkdir()
+    os.environ["REPO_PATH"] = str(not_a_repo)
+    cwd = os.getcwd()
+    os.chdir(not_a_repo)
+    try:
+        client = TestClient(app)
+        last_commit = temp_repo_and_db["commits"][-1]
+        r = client.get(f"/diff/{last_commit}/a.txt")
+    finally:
+        os.chdir(cwd)
+    assert r.status_code == 200
+    assert r.json() == {"before": "hello\n", "after": "hello world\n"}
+    assert 'timewarp_cache_requests_total{cache="diff",result="hit"}' in client.get("/metrics").text
+
+
+def test_shared_cache_serves_snapshots_and_blobs_across_generations(temp_repo_and_db, tmp_path, monkeypatch):
+    import api.app as api_app
+    from shared_cache import SharedCache
+
+    cache = SharedCache(str(tmp_path / "shm"))
+    monkeypatch.setattr(api_app, "shared_cache", cache)
+    client = TestClient(app)
+    last_commit = temp_repo_and_db["commits"][-1]
+
+    assert api_app.warm_snapshot_cache(10) == 1
+    expected = [{"file_id": 1, "path": "a.txt", "churn": 1, "hotspot_score": 0.1}]
+    assert client.get(f"/snapshot/{last_commit}").json() == expected
+    assert 'timewarp_cache_requests_total{cache="snapshot",result="hit"}' in client.get("/metrics").text
+
+    # A new ingest bumps the generation, so the stale payload is not served
+    session = SessionLocal(temp_repo_and_db["db_url"])
+    try:
+        file = File(path="b.txt")
+        session.add(file)
+        session.commit()
+        session.add(Snapshot(commit_id=last_commit, file_id=file.id, churn=2, hotspot_score=0.2))
+        session.commit()
+    finally:
+        session.close()
+    assert len(client.get(f"/snapshot/{last_commit}").json()) == 2
+
+    # Blob contents come back from the cache on the second diff
+    def git_bytes():
+        for line in client.get("/metrics").text.splitlines():
+            if line.startswith('timewarp_git_bytes_read_total{endpoint="diff"}'):
+                return float(line.split()[-1])
+        return 0.0
+
+    first = client.get(f"/diff/{last_commit}/a.txt").json()
+    read = git_bytes()
+    assert client.get(f"/diff/{last_commit}/a.txt").json() == first
+    assert git_bytes() == read
+    assert 'timewarp_cache_requests_total{cache="blob",result="hit"}' in client.get("/metrics").text
+
+
+def test_shared_cache_refuses_directories_others_can_write(tmp_path):
+    from shared_cache import SharedCache
+
+    cache = SharedCache(str(tmp_path / "fresh"))
+    assert (os.stat(cache.directory).st_mode & 0o777) == 0o700
+
+    planted = tmp_path / "planted"
+    planted.mkdir()
+    os.chmod(planted, 0o777)
+    with pytest.raises(PermissionError):
+        SharedCache(str(planted))
+
+    os.symlink(tmp_path / "fresh", tmp_path / "link")
+    with pytest.raises(PermissionError):
+        SharedCache(str(tmp_path / "link"))
+
+
+def test_compact_downsamples_old_periods_and_api_serves_them(tmp_path, monkeypatch):
+    from sqlalchemy import text
+
+    from compact import compact
+    from models import DiffBlob, FileLayout, SnapshotPeriod
+
+    db_url = f"sqlite:///{tmp_path / 'compact.db'}"
+    now = 10 * 86400.0
+    session = SessionLocal(db_url)
+    try:
+        for sha, ts in (("c1", 100.0), ("c2", 200.0), ("c3", 300.0), ("c4", now - 60)):
+            session.add(Commit(id=sha, timestamp=ts, author="t", message=sha))
+        a, b, gone = File(path="a.py"), File(path="b.py"), File(path="gone.py")
+        session.add_all([a, b, gone])
+        session.flush()
+        session.add(FileLayout(file_id=gone.id, directory="", directory_index=0, slot=0, x=0, y=0, z=0))
+        session.add(DiffBlob(blob_before="x", blob_after="y", codec="zlib", before=b"", after=b""))
+        session.add_all(
+            [
+                Snapshot(commit_id="c1", file_id=a.id, churn=1, hotspot_score=0.2, label=0, tmp_features=[1, 1, 0, 0]),
+                Snapshot(commit_id="c2", file_id=a.id, churn=2, hotspot_score=0.5, label=1),
+                Snapshot(commit_id="c2", file_id=b.id, churn=3, hotspot_score=0.1),
+                Snapshot(commit_id="c3", file_id=b.id, churn=1, hotspot_score=0.3),
+                Snapshot(commit_id="c4", file_id=a.id, churn=5, hotspot_score=0.9, tmp_features=[5, 1, 0, 9]),
+            ]
+        )
+        session.commit()
+        a_id, b_id, gone_id = a.id, b.id, gone.id
+    finally:
+        session.close()
+
+    report = compact(db_url, older_than_days=1, period="day", now=now)
+    # c1's features go with its downsampled row; c4's are unlabeled, so never trained on
+    assert report["downsample"] == {"periods": 1, "commits": 2, "snapshots_removed": 2, "features_dropped": 1}
+    assert report["features_dropped"] == 2
+    assert report["orphans"]["files"] == 1
+    assert report["orphans"]["file_layouts"] == 1
+    assert report["orphans"]["diff_blobs"] == 1
+    assert report["bytes_after"] > 0
+
+    session = SessionLocal(db_url)
+    try:
+        assert {p.commit_id: p.representative_id for p in session.query(SnapshotPeriod)} == {"c1": "c3", "c2": "c3"}
+        assert session.query(Snapshot).filter(Snapshot.commit_id.in_(["c1", "c2"])).count() == 0
+        assert session.query(Snapshot).filter(Snapshot.tmp_features.isnot(None)).count() == 0
+        # New databases use incremental auto-vacuum, so every free page was returned
+        assert session.execute(text("PRAGMA freelist_count")).scalar() == 0
+    finally:
+        session.close()
+
+    monkeypatch.setenv("DATABASE_URL", db_url)
+    client = TestClient(app)
+    expected = sorted(
+        [
+            {"file_id": a_id, "path": "a.py", "churn": 3, "hotspot_score": 0.5},
+            {"file_id": b_id, "path": "b.py", "churn": 4, "hotspot_score": 0.3},
+        ],
+        key=lambda s: s["file_id"],
+    )
+    for commit_id in ("c1", "c2", "c3"):
+        r = client.get(f"/snapshot/{commit_id}")
+        assert r.status_code == 200
+        assert sorted(r.json(), key=lambda s: s["file_id"]) == expected
+    assert client.get("/snapshot/c4").json()[0]["churn"] == 5
+
+    # gone.py had the highest id; it is reported as removed and never reissued
+    assert client.get("/layout", params={"since_id": gone_id}).json()["removed"] == [gone_id]
+    assert client.get("/layout").json()["removed"] == []
+    session = SessionLocal(db_url)
+    try:
+        new_file = File(path="zzz/new.py")
+        session.add(new_file)
+        session.commit()
+        assert new_file.id > gone_id
+    finally:
+        session.close()
+
+    # Nothing left to downsample on a second run
+    assert compact(db_url, older_than_days=1, period="day", now=now)["downsample"]["periods"] == 0
+
+
+def test_files_table_migrates_to_autoincrement(tmp_path):
+    import sqlite3
+
+    import models
+    from search import search_files
+
+    db_path = tmp_path / "old.db"
+    db_url = f"sqlite:///{db_path}"
+    models.get_engine(db_url)
+    models.reset_engine(db_url)
+
+    # Recreate the files table as databases before AUTOINCREMENT had it
+    conn = sqlite3.connect(db_path)
+    conn.executescript(
+        """
+        DROP TABLE files;
+        CREATE TABLE files (id INTEGER NOT NULL, path VARCHAR NOT NULL, PRIMARY KEY (id), UNIQUE (path));
+        INSERT INTO files (id, path) VALUES (1, 'src/kept.py'), (2, 'src/other.py');
+        INSERT INTO file_layouts (file_id, directory, directory_index, slot, x, y, z) VALUES (7, 'src', 0, 0, 0, 0, 0);
+        """
+    )
+    conn.close()
+
+    session = SessionLocal(db_url)
+    try:
+        sql = session.execute(text("SELECT sql FROM sqlite_master WHERE name = 'files'")).scalar()
+        assert "AUTOINCREMENT" in sql
+        assert [f.path for f in session.query(File).order_by(File.id)] == ["src/kept.py", "src/other.py"]
+        new_file = File(path="src/fresh.py")
+        session.add(new_file)
+        session.commit()
+        # Above every id a cached layout could still hold
+        assert new_file.id == 8
+        # Search triggers were recreated on the rebuilt table
+        assert [f["path"] for f in search_files(session, "fresh")] == ["src/fresh.py"]
+    finally:
+        session.close()
+
+
+def test_slow_request_profiler_only_keeps_unshared_profiles(tmp_path):
+    import asyncio
+    from types import SimpleNamespace
+
+    import metrics
+    from api.middleware import SlowRequestProfilerMiddleware
+
+    async def slow_app(scope, receive, send):
+        await asyncio.sleep(0.05)
+
+    middleware = SlowRequestProfilerMiddleware(slow_app, threshold_ms=10, output_dir=str(tmp_path))
+    scope = {"type": "http", "method": "GET", "path": "/slow/1", "route": SimpleNamespace(path="/slow/{n}")}
+
+    async def run(concurrent, scope=scope):
+        await asyncio.gather(*(middleware(scope, None, None) for _ in range(concurrent)))
+
+    before = metrics.slow_requests.get(route="/slow/{n}", profiled="false")
+    # Overlapping requests would share one loop-wide profile, so none is kept
+    asyncio.run(run(2))
+    assert list(tmp_path.glob("*.prof")) == []
+    assert metrics.slow_requests.get(route="/slow/{n}", profiled="false") == before + 2
+
+    asyncio.run(run(1))
+    assert [p.name.split("-")[2] for p in tmp_path.glob("*.prof")] == ["slow_n"]
+
+    # Raw paths of unmatched requests would give every probed URL its own label and file
+    before = metrics.slow_requests.get(route="unmatched", profiled="true")
+    asyncio.run(run(1, {"type": "http", "method": "GET", "path": "/wp-admin/x.php"}))
+    assert metrics.slow_requests.get(route="unmatched", profiled="true") == before + 1
+    assert sorted(p.name.split("-")[2] for p in tmp_path.glob("*.prof")) == ["slow_n", "unmatched"]
+
+
+def test_diff_cache_cli_selection_modes(monkeypatch):
+    import sys
+
+    import diff_cache
+
+    calls = []
+    monkeypatch.setattr(diff_cache, "warm", lambda session, repo, threshold, top_k: calls.append((threshold, top_k)) or (0, 0))
+    monkeypatch.setattr(diff_cache.git, "Repo", lambda path: None)
+    for argv in ([], ["--top-k", "5"], ["--threshold", "0.5"], ["--threshold", "0.5", "--top-k", "5"]):
+        monkeypatch.setattr(sys, "argv", ["diff_cache.py", "--repo", ".", "--db-url", "sqlite://", *argv])
+        diff_cache.main()
+    # --top-k alone must not also pull in everything above the default threshold
+    assert calls == [(diff_cache.DEFAULT_THRESHOLD, None), (None, 5), (0.5, None), (0.5, 5)]
@@ -0,0 +1,37 @@
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from ml.real_hotspot import MODEL_PATH, predict
+
+
+def test_numpy_predict_matches_torch_model():
+    torch = pytest.importorskip("torch")
+    from ml.train_hotspot import HotspotNet
+
+    model = HotspotNet()
+    model.load_state_dict(torch.load(MODEL_PATH, map_location="cpu"))
+    model.eval()
+
+    rng = np.random.default_rng(0)
+    X = np.column_stack(
+        [
+            rng.integers(0, 2000, 500),
+            rng.integers(1, 12, 500),
+            rng.integers(0, 2, 500),
+            rng.uniform(-1e3, 3e7, 500),
+        ]
+    ).astype(np.float32)
+    with torch.no_grad():
+        expected = model(torch.from_numpy(X)).squeeze(1).numpy()
+    actual = np.array([predict(row.tolist()) for row in X], dtype=np.float32)
+
+    np.testing.assert_allclose(actual, expected, rtol=1e-6, atol=1e-7)
+
+
+def test_ingest_import_does_not_load_torch():
+    code = "import sys, ingest_repo; ingest_repo.predict([1.0, 1.0, 0.0, 0.0]); print('torch' in sys.modules)"
+    out = subprocess.check_output([sys.executable, "-c", code])
+    assert out.decode().strip() == "False"
@@ -58,3 +58,68 @@ def test_ingest_repository(tmp_path):
     finally:
         # Clean up temporary database file
         os.unlink(db_path)
+
+
+def test_ingest_repository_profile(tmp_path):
+    """--profile writes a cProfile report and a per-phase table."""
+    from profiling import profile_run
+
+    repo_dir = tmp_path / "repo"
+    repo_dir.mkdir()
+    subprocess.run(["git", "init"], cwd=repo_dir, check=True)
+    (repo_dir / "foo.txt").write_text("Hello World")
+    subprocess.run(["git", "add", "foo.txt"], cwd=repo_dir, check=True)
+    subprocess.run(["git", "commit", "-m", "Initial commit"], cwd=repo_dir, check=True)
+
+    profile_dir = tmp_path / "profile"
+    db_url = f"sqlite:///{tmp_path / 'profile.db'}"
+    with profile_run(str(profile_dir), "ingest"):
+        ingest_repository(str(repo_dir), db_url)
+
+    assert (profile_dir / "ingest.prof").exists()
+    assert "cumulative" in (profile_dir / "ingest.txt").read_text()
+    phases = (profile_dir / "ingest-phases.txt").read_text()
+    assert "peak traced memory" in phases
+    assert "git_extraction" in phases
+    assert "db_writes" in phases
+
+
+def test_compact_drops_features_outside_retention_window(tmp_path):
+    """Rows written by ingest_repo.py all carry labels, so only an explicit window drops them."""
+    import time
+
+    from compact import compact
+    from ingest_repo import RepoIngester
+
+    repo_dir = tmp_path / "repo"
+    repo_dir.mkdir()
+    subprocess.run(["git", "init"], cwd=repo_dir, check=True)
+    for i in range(3):
+        (repo_dir / "foo.py").write_text(f"v{i}\n")
+        subprocess.run(["git", "add", "foo.py"], cwd=repo_dir, check=True)
+        subprocess.run(["git", "commit", "-m", f"fix: change {i}"], cwd=repo_dir, check=True)
+
+    db_url = f"sqlite:///{tmp_path / 'features.db'}"
+    ingester = RepoIngester(db_url)
+    try:
+        ingester.ingest_repository(str(repo_dir))
+    finally:
+        ingester.close()
+
+    def with_features():
+        session = SessionLocal(db_url)
+        try:
+            return session.query(Snapshot).filter(Snapshot.tmp_features.isnot(None)).count()
+        finally:
+            session.close()
+
+    assert with_features() == 3
+    later = time.time() + 180 * 86400
+    # Labeled rows are training data; by default they keep their features at any age
+    assert compact(db_url, older_than_days=10000, now=later)["features_dropped"] == 0
+    # Fresh history is inside an explicit window
+    assert compact(db_url, keep_features_days=90)["features_dropped"] == 0
+    # Half a year on (and no downsampling), the same rows have aged out of it
+    report = compact(db_url, older_than_days=10000, keep_features_days=90, now=later)
+    assert report["features_dropped"] == 3
+    assert with_features() == 0
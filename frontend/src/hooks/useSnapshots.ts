@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import axios from "axios";
 import { getApiBase } from "../lib/config";
 
@@ -9,9 +9,17 @@ interface Commit {
 }
 
 interface FileSnapshot {
+  file_id: number;
   path: string;
   churn: number;
   hotspot_score: number;
+  position?: [number, number, number];
+}
+
+interface LayoutResponse {
+  version: number;
+  files: Record<string, { path: string; x: number; y: number; z: number }>;
+  removed?: number[];
 }
 
 interface Directory {
@@ -26,6 +34,21 @@ export function useSnapshots(apiBase: string = getApiBase()) {
   const [dirs, setDirs] = useState<Directory[]>([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
+  // Stable per-file positions from /layout, cached for the whole session
+  const layoutRef = useRef<Map<number, [number, number, number]>>(new Map());
+  const layoutVersionRef = useRef(0);
+
+  const fetchLayout = async () => {
+    const response = await axios.get<LayoutResponse>(`${apiBase}/layout`, {
+      params: { since_id: layoutVersionRef.current },
+    });
+    Object.entries(response.data.files).forEach(([id, f]) => {
+      layoutRef.current.set(Number(id), [f.x, f.y, f.z]);
+    });
+    // Files deleted by compaction; their ids are never reused
+    (response.data.removed ?? []).forEach((id) => layoutRef.current.delete(id));
+    layoutVersionRef.current = response.data.version;
+  };
 
   // Fetch timeline on mount
   useEffect(() => {
@@ -59,7 +82,20 @@ export function useSnapshots(apiBase: string = getApiBase()) {
         setLoading(true);
         const commitId = commits[currentIndex].id;
         const response = await axios.get(`${apiBase}/snapshot/${commitId}`);
-        const snapshotFiles = response.data;
+        const rawFiles: FileSnapshot[] = response.data;
+
+        // Only files first seen after the last layout fetch need a round trip
+        if (rawFiles.some((f) => !layoutRef.current.has(f.file_id))) {
+          try {
+            await fetchLayout();
+          } catch (err) {
+            console.error("Error fetching layout:", err);
+          }
+        }
+        const snapshotFiles = rawFiles.map((f) => ({
+          ...f,
+          position: layoutRef.current.get(f.file_id),
+        }));
 
         setFiles(snapshotFiles);
 
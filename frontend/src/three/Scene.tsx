@@ -4,9 +4,11 @@ import { OrbitControls, Text, Html } from "@react-three/drei";
 import * as THREE from "three";
 
 interface FileSnapshot {
+  file_id: number;
   path: string;
   churn: number;
   hotspot_score: number;
+  position?: [number, number, number];
 }
 
 interface SceneProps {
@@ -95,9 +97,12 @@ export default function Scene({ files, hotspotThreshold = 0.8, resetSignal = 0,
       const jy = hash01(file.path + "y") - 0.5;
       const jz = hash01(file.path + "z") - 0.5;
 
-      const x = Math.cos(spiralAngle) * spiralRadius + jx * 2 + colOffsetX;
-      const y = Math.sin(spiralAngle) * spiralRadius + jy * 2;
-      const z = jz * 8;
+      // Prefer the server-assigned layout: it never moves as files come and go
+      const [x, y, z] = file.position ?? [
+        Math.cos(spiralAngle) * spiralRadius + jx * 2 + colOffsetX,
+        Math.sin(spiralAngle) * spiralRadius + jy * 2,
+        jz * 8,
+      ];
 
       const churnFactor = Math.min(file.churn / maxChurn, 1);
       const hotspotFactor = Math.min(Math.max(file.hotspot_score, 0), 1);
@@ -185,7 +190,7 @@ export default function Scene({ files, hotspotThreshold = 0.8, resetSignal = 0,
       <group ref={groupRef}>
         {filePositions.map((item, index) => (
           <mesh
-            key={index}
+            key={item.file.file_id ?? index}
             position={item.position}
             onClick={() => onFileClick(item.file.path)}
             onPointerOver={(e) => {